@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# ARQUIVADOR: CONCLUÍDAS ANTIGAS SAEM DA TABELA QUENTE
+# =============================================================================
+# As consultas do dia a dia (lista, galeria, lembretes) só tocam nas
+# pendentes, mas as concluídas continuam ocupando páginas da tabela e dos
+# índices de `tarefas`. De tempos em tempos, as concluídas há mais de
+# `min_age` segundos são movidas para `tarefas_arquivo`:
+#
+#   - em lotes pequenos (`batch_size` linhas por transação, com uma pausa
+#     entre eles), para nunca segurar o lock de escrita por muito tempo;
+#   - fora do group commit, então um lote grande não atrasa as escritas dos
+#     handlers que estão na fila;
+#   - /historico e /exportar leem as duas tabelas, então nada some para o
+#     usuário.
+#
+# As páginas liberadas voltam para o sistema com PRAGMA incremental_vacuum,
+# poucas de cada vez (só em bancos com auto_vacuum = INCREMENTAL; a conversão
+# de um banco antigo é opt-in, ver COMPACT_DB_ON_START), e o PRAGMA optimize
+# roda de hora em hora; os dois só quando o banco está ocioso há pelo menos
+# `quiet_period` segundos.
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Archiver:
+    """Move as concluídas antigas para o arquivo e compacta o banco nos períodos ociosos."""
+
+    def __init__(
+        self,
+        storage,
+        min_age: float,
+        batch_size: int = 500,
+        interval: float = 600,
+        pause: float = 0.05,
+        quiet_period: float = 30,
+        vacuum_pages: int = 256,
+        optimize_interval: float = 3600,
+    ):
+        self.storage = storage
+        self.min_age = min_age
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self.quiet_period = quiet_period
+        self.vacuum_pages = vacuum_pages
+        self.optimize_interval = optimize_interval
+        self._last_optimize = time.monotonic()
+        self._task = None
+
+    def start(self) -> None:
+        """Começa o laço de fundo (idempotente)."""
+        if self._task is not None:
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Para o laço; um lote interrompido é só uma transação a menos."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                archived = await self.archive()
+                if archived:
+                    logger.info("Arquivador: %d tarefas concluídas movidas para o arquivo", archived)
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Erro no arquivador: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def archive(self) -> int:
+        """Arquiva, lote a lote, tudo o que passou de `min_age`; devolve quantas moveu."""
+        cutoff = int(time.time() - self.min_age)
+        total = 0
+        while True:
+            moved = await self.storage.archive_completed(cutoff, self.batch_size)
+            total += moved
+            if moved < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
+
+    async def compact(self) -> None:
+        """VACUUM incremental e optimize, parando assim que os handlers voltarem a usar o banco."""
+        while self.storage.incremental_vacuum_enabled and self.storage.idle_for() >= self.quiet_period:
+            remaining = await self.storage.incremental_vacuum(self.vacuum_pages)
+            if not remaining:
+                break
+            await asyncio.sleep(self.pause)
+        if (self.storage.idle_for() >= self.quiet_period
+                and time.monotonic() - self._last_optimize >= self.optimize_interval):
+            await self.storage.optimize()
+            self._last_optimize = time.monotonic()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# SERVIDOR LOCAL QUE IMITA A BOT API DO TELEGRAM (PARA BENCHMARKS)
+# =============================================================================
+# Responde POST /bot<token>/<método> com respostas mínimas porém válidas para
+# o python-telegram-bot, sem acesso à rede. Suporta keep-alive e uma latência
+# artificial opcional para imitar a ida e volta até o Telegram.
+#
+# Uso isolado:
+#     python benchmarks/fake_bot_api.py --port 8081 --latency-ms 20
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+_message_ids = itertools.count(1)
+
+
+def _param(params: dict, name: str, default=None):
+    """Os parâmetros chegam como strings JSON dentro de um form urlencoded."""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _message(params: dict, **extra) -> dict:
+    chat_id = _param(params, "chat_id", 0)
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "group"},
+        "from": BOT_USER,
+    }
+    message.update(extra)
+    return message
+
+
+def _media(kind: str, file_id: str) -> dict:
+    unique = f"u-{abs(hash(file_id))}"
+    if kind == "photo":
+        return {"photo": [{"file_id": file_id, "file_unique_id": unique, "width": 1, "height": 1}]}
+    return {"video": {"file_id": file_id, "file_unique_id": unique, "width": 1, "height": 1, "duration": 1}}
+
+
+def handle_method(method: str, params: dict):
+    """Resultado da chamada `method` (o campo `result` da resposta)."""
+    if method == "getMe":
+        return BOT_USER
+    if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+        return _message(params, text=_param(params, "text", ""))
+    if method == "sendPhoto":
+        return _message(params, caption=_param(params, "caption"), **_media("photo", str(_param(params, "photo"))))
+    if method == "sendVideo":
+        return _message(params, caption=_param(params, "caption"), **_media("video", str(_param(params, "video"))))
+    if method == "sendMediaGroup":
+        items = _param(params, "media", [])
+        return [
+            _message(params, caption=item.get("caption"), **_media(item["type"], str(item["media"])))
+            for item in items
+        ]
+    if method == "sendDocument":
+        document = {"file_id": "doc", "file_unique_id": "doc"}
+        return _message(params, document=document)
+    if method == "getUpdates":
+        return []
+    if method == "getFile":
+        return {"file_id": _param(params, "file_id"), "file_unique_id": "f", "file_path": "arquivo"}
+    return True
+
+
+class FakeBotAPI:
+    """Servidor HTTP/1.1 mínimo sobre asyncio streams."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency_ms: float = 0):
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.calls = {}
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self._dispatch(path, headers, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, path: str, headers: dict, body: bytes):
+        if path == "/stats":
+            return 200, self.calls
+        method = path.rstrip("/").rsplit("/", 1)[-1]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = {}
+        content_type = headers.get("content-type", "")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        elif content_type.startswith("application/json") and body:
+            params = {key: json.dumps(value) for key, value in json.loads(body).items()}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, {"ok": True, "result": handle_method(method, params)}
+
+
+def run(host: str, port: int, latency_ms: float, ready=None) -> None:
+    """Sobe o servidor e bloqueia (usado também como alvo de multiprocessing)."""
+    async def serve():
+        server = FakeBotAPI(host, port, latency_ms)
+        await server.start()
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bot API falsa para testes de carga.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    arguments = parser.parse_args()
+    print(f"Bot API falsa em http://{arguments.host}:{arguments.port}")
+    run(arguments.host, arguments.port, arguments.latency_ms)
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# TESTE DE CARGA DOS HANDLERS CONTRA UMA BOT API LOCAL
+# =============================================================================
+# Sobe a Bot API falsa (benchmarks/fake_bot_api.py) num processo separado,
+# monta o Application de verdade (build_application) apontando para ela e
+# simula milhares de usuários fazendo o fluxo de nova tarefa e a listagem:
+#
+#   /start -> "➕ Nova Tarefa" -> título -> "🔗 Link" + link | "⏭️ Pular"
+#          -> "📝 Minhas Tarefas"
+#
+# Para cada handler, mede vazão e latência p50/p95/p99, além do tempo gasto
+# no SQLite e do número de chamadas à Bot API por ação. Não usa a rede.
+#
+# Uso (na raiz do repositório):
+#     python -m benchmarks.loadtest --users 2000 --concurrency 200
+#     python -m benchmarks.loadtest --json bench.json   # para comparar commits
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_bot_api
+
+TOKEN = "123456:BENCHMARK"
+
+# Contadores da ação em andamento (herdados pelas chamadas feitas dentro dela)
+_current_action = contextvars.ContextVar("current_action", default=None)
+
+
+class ActionStats:
+    """Medidas de uma única ação de um usuário."""
+
+    __slots__ = ("db_seconds", "db_calls", "api_calls")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.db_calls = 0
+        self.api_calls = 0
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Percentil por posição (nearest-rank) de uma lista já ordenada."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# =============================================================================
+# INSTRUMENTAÇÃO (SÓ DENTRO DO BENCHMARK)
+# =============================================================================
+def instrument_storage(storage) -> None:
+    """Soma o tempo de cada read/write do TaskStorage na ação corrente."""
+    for name in ("read", "write"):
+        original = getattr(storage, name)
+
+        async def timed(func, *args, _original=original):
+            started = time.perf_counter()
+            try:
+                return await _original(func, *args)
+            finally:
+                stats = _current_action.get()
+                if stats is not None:
+                    stats.db_seconds += time.perf_counter() - started
+                    stats.db_calls += 1
+
+        setattr(storage, name, timed)
+
+
+def counting_request_class():
+    from telegram.request import HTTPXRequest
+
+    class CountingRequest(HTTPXRequest):
+        """HTTPXRequest que conta as chamadas à Bot API feitas em cada ação."""
+
+        async def do_request(self, url, method, request_data=None, *args, **kwargs):
+            stats = _current_action.get()
+            if stats is not None:
+                stats.api_calls += 1
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+
+    return CountingRequest
+
+
+# =============================================================================
+# UPDATES SINTÉTICOS
+# =============================================================================
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Usuário{user_id}"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": f"{user_id}-{update_id}",
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": fake_bot_api.BOT_USER,
+                "text": "...",
+            },
+        },
+    }
+
+
+def user_script(user_id: int, tasks_per_user: int, counter) -> list:
+    """Sequência de (handler, update) de um usuário sintético."""
+    script = [("start", message_update(next(counter), user_id, "/start"))]
+    for number in range(tasks_per_user):
+        script.append(("start_add_task", message_update(next(counter), user_id, "➕ Nova Tarefa")))
+        script.append(("get_task_title", message_update(next(counter), user_id, f"Tarefa {number} de {user_id}")))
+        if (user_id + number) % 2:
+            script.append(("handle_attachment_choice", callback_update(next(counter), user_id, "add_link")))
+            script.append(("get_link", message_update(next(counter), user_id, f"https://exemplo.com/{number}")))
+        else:
+            script.append(("handle_attachment_choice", callback_update(next(counter), user_id, "skip_attachment")))
+    script.append(("list_tasks", message_update(next(counter), user_id, "📝 Minhas Tarefas")))
+    return script
+
+
+# =============================================================================
+# EXECUÇÃO
+# =============================================================================
+async def run_load(bot_module, base_url: str, arguments) -> dict:
+    from telegram import Update
+    from telegram.ext import Application
+
+    CountingRequest = counting_request_class()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(base_url)
+        .request(CountingRequest(connection_pool_size=arguments.concurrency + 8))
+    )
+    application = bot_module.build_application(builder, rate_limit=arguments.rate_limit)
+    instrument_storage(bot_module.storage)
+
+    samples = {}
+    counter = iter(range(1, 10 ** 12))
+    gate = asyncio.Semaphore(arguments.concurrency)
+
+    async def play(user_id: int) -> None:
+        async with gate:
+            for handler, data in user_script(user_id, arguments.tasks_per_user, counter):
+                stats = ActionStats()
+                token = _current_action.set(stats)
+                update = Update.de_json(data, application.bot)
+                started = time.perf_counter()
+                try:
+                    await application.update_processor.process_update(update, application.process_update(update))
+                finally:
+                    _current_action.reset(token)
+                elapsed = time.perf_counter() - started
+                samples.setdefault(handler, []).append((elapsed, stats))
+
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(play(100000 + number) for number in range(arguments.users)))
+    finally:
+        wall = time.perf_counter() - started
+        await application.stop()
+        await application.shutdown()
+        await bot_module.storage.flush()
+        bot_module.storage.close()
+
+    return build_report(samples, wall, arguments)
+
+
+def build_report(samples: dict, wall: float, arguments) -> dict:
+    handlers = {}
+    total_actions = 0
+    for handler, entries in sorted(samples.items()):
+        latencies = sorted(elapsed for elapsed, _ in entries)
+        count = len(entries)
+        total_actions += count
+        handlers[handler] = {
+            "count": count,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "db_ms_per_action": sum(stats.db_seconds for _, stats in entries) * 1000 / count,
+            "db_calls_per_action": sum(stats.db_calls for _, stats in entries) / count,
+            "api_calls_per_action": sum(stats.api_calls for _, stats in entries) / count,
+        }
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "users": arguments.users,
+        "concurrency": arguments.concurrency,
+        "tasks_per_user": arguments.tasks_per_user,
+        "api_latency_ms": arguments.api_latency_ms,
+        "wall_seconds": wall,
+        "actions": total_actions,
+        "actions_per_second": total_actions / wall if wall else 0.0,
+        "handlers": handlers,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"\ncommit {report['commit']} | {report['users']} usuários, concorrência {report['concurrency']}, "
+        f"latência da API {report['api_latency_ms']} ms"
+    )
+    print(f"{report['actions']} ações em {report['wall_seconds']:.2f}s = {report['actions_per_second']:.1f} ações/s\n")
+    print(f"{'handler':<26}{'n':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'DB ms':>8}{'DB q':>6}{'API':>6}")
+    for handler, row in report["handlers"].items():
+        print(
+            f"{handler:<26}{row['count']:>7}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+            f"{row['db_ms_per_action']:>8.2f}{row['db_calls_per_action']:>6.1f}{row['api_calls_per_action']:>6.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Teste de carga dos handlers do bot.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="usuários simultâneos")
+    parser.add_argument("--tasks-per-user", type=int, default=3)
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="latência artificial da Bot API")
+    parser.add_argument("--rate-limit", action="store_true", help="mantém a fila de envio com os limites do Telegram")
+    parser.add_argument("--group-commit", action="store_true", help="liga o group commit do TaskStorage")
+    parser.add_argument("--json", help="grava o relatório em JSON neste caminho")
+    arguments = parser.parse_args()
+
+    port = _free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=fake_bot_api.run, args=("127.0.0.1", port, arguments.api_latency_ms, ready), daemon=True
+    )
+    server.start()
+    ready.wait(10)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # O bot lê a configuração na importação
+        os.environ["DB_NAME"] = os.path.join(directory, "bench.db")
+        os.environ["GROUP_COMMIT"] = "1" if arguments.group_commit else "0"
+        os.environ.setdefault("CONCURRENT_UPDATES", str(arguments.concurrency))
+        # Os usuários sintéticos agem sem pausa nenhuma: sem limite por usuário
+        os.environ.setdefault("USER_RATE_LIMIT", "0")
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import minhastarefinhasbot as bot_module
+
+        bot_module.setup_database()
+        try:
+            report = asyncio.run(run_load(bot_module, f"http://127.0.0.1:{port}/bot", arguments))
+        finally:
+            server.terminate()
+
+    print_report(report)
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# CACHE LRU COM TTL (EM MEMÓRIA, NO THREAD DO EVENT LOOP)
+# =============================================================================
+# Não é thread-safe de propósito: só é usado a partir do event loop, onde não
+# há concorrência real entre um `get` e um `put`.
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Dicionário limitado por tamanho e por idade das entradas, com contadores."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return self.peek(key) is not None
+
+    def get(self, key):
+        """Devolve o valor (ou None) e conta acerto/erro."""
+        value = self.peek(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def peek(self, key):
+        """Como `get`, mas sem mexer nos contadores nem na ordem LRU."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
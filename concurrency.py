@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# PROCESSAMENTO CONCORRENTE DE UPDATES COM ORDEM POR USUÁRIO
+# =============================================================================
+# Updates de usuários diferentes rodam em paralelo (até `max_concurrent_updates`),
+# mas os de um mesmo usuário continuam um depois do outro, na ordem de
+# chegada. Assim o ConversationHandler (GET_TITLE/GET_ATTACHMENT/GET_LINK) e o
+# user_data nunca veem duas mensagens do mesmo usuário ao mesmo tempo.
+#
+# Antes de entrar na fila do usuário, cada update passa por:
+#   - um token bucket por usuário (`rate` updates/s, rajadas de até `burst`):
+#     quem passa do limite tem o update descartado e recebe um aviso (no
+#     máximo um por janela de `burst / rate` segundos). Consultas inline ficam
+#     de fora: o Telegram as envia enquanto o usuário ainda está digitando;
+#   - coalescência (single-flight): um toque repetido no mesmo botão inline, ou
+#     o mesmo texto de menu/comando, enquanto o primeiro ainda espera ou roda,
+#     não gera uma segunda execução; ele só acompanha a que já existe.
+# Callback queries descartadas são respondidas, para o botão não ficar
+# carregando no app.
+import asyncio
+import logging
+import time
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_key(update: object):
+    """Chave de ordenação do update: o usuário (ou o chat, se não houver usuário)."""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+        if update.effective_chat is not None:
+            return ('chat', update.effective_chat.id)
+    return None
+
+
+def action_key(update: object, coalesce_texts=frozenset()):
+    """Identidade da ação pedida no update (None = nunca coalescer).
+
+    Botão inline: a mensagem e o callback_data. Mensagem: só o texto exato
+    dos botões do menu (`coalesce_texts`) ou de um comando.
+    """
+    if not isinstance(update, Update):
+        return None
+    query = update.callback_query
+    if query is not None:
+        message_id = query.message.message_id if query.message else query.inline_message_id
+        return ('callback', message_id, query.data)
+    message = update.message
+    if message is not None and message.text:
+        if message.text in coalesce_texts or message.text.startswith('/'):
+            return ('text', message.text)
+    return None
+
+
+class TokenBuckets:
+    """Um token bucket por chave: `rate` fichas por segundo, até `burst` acumuladas."""
+
+    # Buckets cheios há tanto tempo são esquecidos na próxima limpeza
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        # chave -> [fichas, instante da última atualização, instante do último aviso]
+        self._buckets = {}
+        self._next_prune = clock() + self.PRUNE_INTERVAL
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key) -> bool:
+        """Gasta uma ficha do bucket da chave; False se ele estiver vazio."""
+        now = self._clock()
+        if now >= self._next_prune:
+            self._prune(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now, None]
+        else:
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def notice_due(self, key) -> bool:
+        """True uma vez por janela (tempo de encher o bucket) para avisar o usuário bloqueado."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return False
+        now = self._clock()
+        if bucket[2] is not None and now - bucket[2] < self.burst / self.rate:
+            return False
+        bucket[2] = now
+        return True
+
+    def _prune(self, now: float) -> None:
+        full_after = self.burst / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < full_after
+        }
+        self._next_prune = now + self.PRUNE_INTERVAL
+
+
+# Limite passado ao semáforo do PTB, que é adquirido antes da vez do usuário;
+# o limite de verdade é o `_slots`, pego só com o lock do usuário na mão
+UNLIMITED_SLOTS = 2 ** 31 - 1
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processa updates concorrentemente, serializando os de cada usuário.
+
+    As `max_concurrent_updates` vagas só são ocupadas por updates que já estão
+    rodando: um usuário com uma fila longa (ex.: toques repetidos durante o
+    /importar) espera a vez dele sem segurar vagas dos outros usuários.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int,
+        rate: float = 0,
+        burst: int = 30,
+        coalesce_texts=frozenset(),
+        rate_limit_notice: str = None,
+    ):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(UNLIMITED_SLOTS)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # chave -> [lock, quantidade de updates usando o lock]
+        self._locks = {}
+        # rate=0 desliga o limite por usuário
+        self._buckets = TokenBuckets(rate, burst) if rate > 0 else None
+        self.coalesce_texts = frozenset(coalesce_texts)
+        # Resposta a uma mensagem descartada pelo limite (None = descarta calado)
+        self.rate_limit_notice = rate_limit_notice
+        # (chave, ação) -> future da execução que está na fila ou rodando
+        self._inflight = {}
+        self.rejected = 0
+        self.coalesced = 0
+
+    def metrics(self) -> dict:
+        """Contadores para o /metrics."""
+        return {
+            'rejected': self.rejected,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+            'buckets': len(self._buckets) if self._buckets is not None else 0,
+        }
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        limited = self._buckets is not None and update.inline_query is None
+        if limited and not self._buckets.allow(key):
+            self.rejected += 1
+            logger.debug("Update %s de %s descartado pelo limite por usuário", update.update_id, key)
+            await self._discard(update, coroutine)
+            if self.rate_limit_notice and update.message is not None and self._buckets.notice_due(key):
+                try:
+                    await update.message.reply_text(self.rate_limit_notice)
+                except TelegramError:
+                    pass
+            return
+
+        action = action_key(update, self.coalesce_texts)
+        if action is None:
+            await self._run_serialized(key, coroutine)
+            return
+        flight_key = (key, action)
+        flight = self._inflight.get(flight_key)
+        if flight is not None:
+            self.coalesced += 1
+            await self._discard(update, coroutine)
+            await asyncio.shield(flight)
+            return
+
+        flight = self._inflight[flight_key] = asyncio.get_running_loop().create_future()
+        try:
+            await self._run_serialized(key, coroutine)
+        finally:
+            del self._inflight[flight_key]
+            flight.set_result(None)
+
+    @staticmethod
+    async def _discard(update: Update, coroutine) -> None:
+        """Descarta o update sem rodar os handlers."""
+        coroutine.close()
+        if update.callback_query is not None:
+            try:
+                await update.callback_query.answer()
+            except TelegramError:
+                pass
+
+    async def _run_serialized(self, key, coroutine) -> None:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        """Nada a preparar."""
+
+    async def shutdown(self) -> None:
+        """Nada a liberar."""
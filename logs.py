@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# LOGS ESTRUTURADOS FORA DO EVENT LOOP
+# =============================================================================
+# Os handlers só colocam o LogRecord numa fila (QueueHandler); a formatação da
+# mensagem, o JSON e a escrita no stderr acontecem num thread separado
+# (QueueListener). No thread do event loop sobra só:
+#   - o filtro de amostragem, que descarta eventos de alto volume (ex.:
+#     "Tarefa salva com sucesso", 1 a cada N) logo depois de o logging criar
+#     o LogRecord, antes de a mensagem ser formatada ou ir para a fila;
+#   - o filtro de contexto, que copia user_id, handler e a duração até agora
+#     do handler em andamento (ver `handler_context`) para o record.
+#
+# Por isso as chamadas usam argumentos %-style (`logger.info("... %s", x)`):
+# a mensagem final só é montada no thread de escrita, e nem é montada se o
+# nível estiver desligado.
+#
+# Cada linha é um objeto JSON:
+#   {"ts": "...", "level": "INFO", "logger": "...", "msg": "...",
+#    "user_id": 123, "handler": "save_task", "duration_ms": 4.2}
+# (LOG_FORMAT=text volta ao formato de texto de antes.)
+import atexit
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime, timezone
+
+# (user_id, nome do handler, instante de início) do handler em andamento
+_handler_context = contextvars.ContextVar('handler_context', default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+@contextlib.contextmanager
+def handler_context(handler: str, user_id=None):
+    """Marca os logs emitidos dentro do bloco com o handler e o usuário."""
+    token = _handler_context.set((user_id, handler, time.perf_counter()))
+    try:
+        yield
+    finally:
+        _handler_context.reset(token)
+
+
+def current_handler():
+    """Nome do handler em andamento neste contexto (None fora de handlers)."""
+    context = _handler_context.get()
+    return context[1] if context is not None else None
+
+
+class ContextFilter(logging.Filter):
+    """Copia o contexto do handler para o record (roda no thread de quem loga)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _handler_context.get()
+        if context is not None:
+            user_id, handler, started = context
+            if not hasattr(record, 'user_id'):
+                record.user_id = user_id
+            if not hasattr(record, 'handler'):
+                record.handler = handler
+            if not hasattr(record, 'duration_ms'):
+                record.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar 1 a cada N records de cada mensagem amostrada.
+
+    `rates` mapeia o texto da mensagem *antes* da formatação (o template
+    %-style) para N. Os records que passam levam `sample_rate=N`.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {message: rate for message, rate in rates.items() if rate > 1}
+        self._counters = {message: itertools.count() for message in self.rates}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.msg)
+        if rate is None:
+            return True
+        if next(self._counters[record.msg]) % rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que não formata nada no thread de quem loga.
+
+    O `prepare` padrão monta a mensagem para o record poder ir para outro
+    processo; aqui a fila é do próprio processo, então o record vai como está.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Campos extras copiados para o JSON quando presentes no record
+EXTRA_FIELDS = ('user_id', 'handler', 'duration_ms', 'sample_rate')
+
+
+class JSONFormatter(logging.Formatter):
+    """Uma linha JSON por record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = 'INFO', fmt: str = 'json', sampling: dict = None) -> logging.handlers.QueueListener:
+    """Troca os handlers do logger raiz pela fila e sobe o thread de escrita.
+
+    O listener para sozinho (esvaziando a fila) quando o processo termina.
+    """
+    stream = logging.StreamHandler()
+    stream.setFormatter(JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(sampling))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
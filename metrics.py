@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# MÉTRICAS (FORMATO DE TEXTO DO PROMETHEUS)
+# =============================================================================
+# - latência de cada handler registrado (instrumentação automática) e erros
+#   por tipo de exceção: os que escapam dos handlers e os que eles capturam e
+#   registram com logger.error (o padrão de todos os handlers do bot);
+# - tempo de cada consulta do TaskStorage (leitura/escrita);
+# - chamadas à Bot API: quantidade e latência por método, erros por tipo;
+# - medidas já existentes (fila de envio, cache de pendentes) via coletores.
+#
+# A instrumentação dos handlers também marca os logs emitidos dentro deles
+# com o handler, o usuário e a duração (ver logs.py).
+#
+# No caminho quente só há um perf_counter, um bisect e alguns incrementos de
+# inteiros no thread do event loop; a renderização do texto acontece no thread
+# do servidor HTTP, só quando o Prometheus faz o scrape.
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+from logs import current_handler, handler_context
+
+logger = logging.getLogger(__name__)
+
+# Limites dos buckets em segundos (de 1 ms a 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Histograma com rótulos; uma lista de contagens por combinação de rótulos."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # valores dos rótulos -> [contagens por bucket..., +Inf, soma]
+        self._series = {}
+
+    def observe(self, label_values: tuple, seconds: float) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, series in list(self._series.items()):
+            series = list(series)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Contador com rótulos."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, label_values: tuple, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+HANDLER_LATENCY = Histogram('bot_handler_latency_seconds', 'Tempo de execução de cada handler.', ('handler',))
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', 'Erros dos handlers (exceções que escaparam ou registradas com logger.error).',
+    ('handler', 'exception')
+)
+DB_QUERY_LATENCY = Histogram('bot_db_query_seconds', 'Tempo das consultas ao SQLite (incluindo a fila do pool).', ('kind', 'query'))
+API_LATENCY = Histogram('bot_api_request_seconds', 'Latência das chamadas à Bot API.', ('method',))
+API_ERRORS = Counter('bot_api_errors_total', 'Chamadas à Bot API que falharam.', ('method', 'exception'))
+
+_METRICS = [HANDLER_LATENCY, HANDLER_ERRORS, DB_QUERY_LATENCY, API_LATENCY, API_ERRORS]
+
+# Funções que devolvem [(nome, tipo, rótulos, valor)] no momento do scrape
+_collectors = []
+
+
+def add_collector(collector) -> None:
+    """Registra uma função que devolve medidas prontas: [(nome, tipo, {rótulos}, valor)]."""
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """Todas as métricas no formato de texto do Prometheus."""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    declared = set()
+    for collector in _collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            logger.error("Erro no coletor de métricas %s: %s", collector, e)
+            continue
+        for name, kind, labels, value in samples:
+            if name not in declared:
+                lines.append(f"# TYPE {name} {kind}")
+                declared.add(name)
+            lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# =============================================================================
+# INSTRUMENTAÇÃO
+# =============================================================================
+def _instrument_callback(callback):
+    name = getattr(callback, '__name__', repr(callback))
+
+    @functools.wraps(callback)
+    async def instrumented(update, context):
+        user = getattr(update, 'effective_user', None)
+        with handler_context(name, user.id if user is not None else None):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception as e:
+                HANDLER_ERRORS.inc((name, type(e).__name__))
+                raise
+            finally:
+                HANDLER_LATENCY.observe((name,), time.perf_counter() - started)
+                logger.debug("Handler %s concluído", name)
+
+    instrumented.__instrumented__ = True
+    return instrumented
+
+
+def _instrument_handler(handler) -> None:
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks:
+            _instrument_handler(inner)
+        for state_handlers in handler.states.values():
+            for inner in state_handlers:
+                _instrument_handler(inner)
+        return
+    callback = getattr(handler, 'callback', None)
+    if callback is not None and not getattr(callback, '__instrumented__', False):
+        handler.callback = _instrument_callback(callback)
+
+
+class _HandlerErrorCounter(logging.Handler):
+    """Conta os logs de ERROR emitidos dentro de um handler, por tipo de exceção.
+
+    Os handlers capturam Exception e registram com `logger.error("...: %s", e)`;
+    o tipo vem do exc_info ou, sem ele, da exceção passada nos argumentos.
+    Roda no thread de quem loga, onde o contexto do handler ainda existe.
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        handler = current_handler()
+        if handler is None:
+            return
+        if record.exc_info and record.exc_info[0] is not None:
+            exception = record.exc_info[0].__name__
+        else:
+            args = record.args if isinstance(record.args, tuple) else ()
+            exception = next((type(arg).__name__ for arg in args if isinstance(arg, BaseException)), 'unknown')
+        HANDLER_ERRORS.inc((handler, exception))
+
+
+_error_counter = _HandlerErrorCounter()
+
+
+def instrument_application(application) -> None:
+    """Envolve o callback de todos os handlers já registrados (inclusive dentro de conversas)."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+    root = logging.getLogger()
+    if _error_counter not in root.handlers:
+        root.addHandler(_error_counter)
+
+
+def observe_query(kind: str, query: str, seconds: float) -> None:
+    """Observador para o TaskStorage (`storage.query_observer = observe_query`)."""
+    DB_QUERY_LATENCY.observe((kind, query), seconds)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest que mede cada chamada à Bot API por método."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc((api_method, type(e).__name__))
+            raise
+        finally:
+            API_LATENCY.observe((api_method,), time.perf_counter() - started)
+        if code >= 400:
+            # 400/403/429 etc.; o PTB transforma em exceção logo depois
+            API_ERRORS.inc((api_method, f"HTTP{code}"))
+        return code, payload
+
+
+# =============================================================================
+# SERVIDOR HTTP /metrics
+# =============================================================================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Um scrape a cada poucos segundos não precisa ir para o log
+        pass
+
+
+def start_http_server(port: int, address: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Sobe o endpoint /metrics num thread daemon (fora do event loop)."""
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logger.info("Métricas disponíveis em http://%s:%d/metrics", address, port)
+    return server
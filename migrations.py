@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# MIGRAÇÕES VERSIONADAS DO SCHEMA
+# =============================================================================
+# A versão do schema fica em `PRAGMA user_version` dentro do próprio tarefas.db.
+# Cada migração roda na sua própria transação (BEGIN IMMEDIATE) junto com a
+# atualização da versão, então um arquivo antigo é atualizado no lugar e um
+# segundo processo subindo ao mesmo tempo apenas espera o lock e pula o que
+# já foi aplicado.
+#
+# Regras para novas migrações: só acrescentar ao final da lista e preferir
+# operações baratas no SQLite (ADD COLUMN é O(1); CREATE INDEX segura o lock
+# de escrita só enquanto constrói o índice).
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+def _v1_create_tarefas(conn: sqlite3.Connection) -> None:
+    # Schema original (bancos criados antes das migrações já estão aqui)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tarefas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            titulo TEXT NOT NULL,
+            tipo_anexo TEXT DEFAULT 'nenhum',
+            id_anexo TEXT,
+            concluida INTEGER DEFAULT 0
+        )
+    ''')
+
+
+def _v2_timestamps_and_pending_index(conn: sqlite3.Connection) -> None:
+    # Datas em segundos desde a época (UTC); linhas antigas ficam com NULL
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(tarefas)")}
+    if 'created_at' not in columns:
+        conn.execute("ALTER TABLE tarefas ADD COLUMN created_at INTEGER")
+    if 'done_at' not in columns:
+        conn.execute("ALTER TABLE tarefas ADD COLUMN done_at INTEGER")
+    # Índice parcial: só as tarefas pendentes, ordenadas por id dentro do usuário
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tarefas_pendentes
+        ON tarefas (user_id, id) WHERE concluida = 0
+    ''')
+
+
+def _v3_conversation_persistence(conn: sqlite3.Connection) -> None:
+    # user_data (JSON) e estados dos ConversationHandlers, ver persistence.py
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversas (
+            nome TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (nome, chave)
+        )
+    ''')
+
+
+def _v4_full_text_search(conn: sqlite3.Connection) -> None:
+    # Índice FTS5 dos títulos das tarefas pendentes. `dono` ("u<user_id>") entra
+    # no índice para que a busca de um usuário não percorra as dos outros.
+    # remove_diacritics 2: "acao" encontra "ação"
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tarefas_fts USING fts5(
+            titulo, dono, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    # Tarefas com id em (feito, fim] existiam antes desta migração e ainda não
+    # foram indexadas; o preenchimento roda em lotes com o bot no ar
+    # (TaskStorage.backfill_search_index). As novas entram pelos gatilhos.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fts_backfill (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            feito INTEGER NOT NULL,
+            fim INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO fts_backfill (id, feito, fim)
+        SELECT 1, 0, COALESCE(MAX(id), 0) FROM tarefas
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tarefas_fts_insert AFTER INSERT ON tarefas
+        WHEN new.concluida = 0
+        BEGIN
+            INSERT INTO tarefas_fts (rowid, titulo, dono) VALUES (new.id, new.titulo, 'u' || new.user_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tarefas_fts_delete AFTER DELETE ON tarefas
+        BEGIN
+            DELETE FROM tarefas_fts WHERE rowid = old.id;
+        END
+    ''')
+    # Concluir a tarefa tira do índice; só reindexa linhas fora da faixa pendente do preenchimento
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tarefas_fts_update AFTER UPDATE OF titulo, user_id, concluida ON tarefas
+        BEGIN
+            DELETE FROM tarefas_fts WHERE rowid = old.id;
+            INSERT INTO tarefas_fts (rowid, titulo, dono)
+            SELECT new.id, new.titulo, 'u' || new.user_id
+            FROM fts_backfill
+            WHERE new.concluida = 0 AND (new.id <= feito OR new.id > fim);
+        END
+    ''')
+
+
+def _v5_due_dates_and_reminders(conn: sqlite3.Connection) -> None:
+    # due_at: prazo (segundos UTC); reminded_at: quando o lembrete foi entregue;
+    # reminder_lease: até quando um despachante "reservou" o envio (ver reminders.py)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(tarefas)")}
+    for column in ('due_at', 'reminded_at', 'reminder_lease'):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE tarefas ADD COLUMN {column} INTEGER")
+    # Índice parcial só com os lembretes ainda por enviar, ordenados por prazo:
+    # tarefas sem prazo, concluídas ou já lembradas não ocupam espaço nele
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tarefas_lembretes
+        ON tarefas (due_at) WHERE concluida = 0 AND reminded_at IS NULL AND due_at IS NOT NULL
+    ''')
+
+
+def _v6_completed_tasks_index(conn: sqlite3.Connection) -> None:
+    # Par do idx_tarefas_pendentes para as concluídas (exportação e histórico).
+    # Um índice em (user_id, id) sem filtro "roubaria" as consultas de pendentes
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tarefas_concluidas
+        ON tarefas (user_id, id) WHERE concluida = 1
+    ''')
+
+
+def _v7_archive(conn: sqlite3.Connection) -> None:
+    # Concluídas antigas saem de `tarefas` para cá (ver archiver.py); o id é mantido
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tarefas_arquivo (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            titulo TEXT NOT NULL,
+            tipo_anexo TEXT,
+            id_anexo TEXT,
+            created_at INTEGER,
+            done_at INTEGER NOT NULL,
+            due_at INTEGER,
+            archived_at INTEGER NOT NULL
+        )
+    ''')
+    # /historico: do mais recente para o mais antigo dentro do usuário
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_arquivo_usuario ON tarefas_arquivo (user_id, done_at, id)
+    ''')
+    # Concluídas antes da v2 não têm data; passam a contar desde a criação (ou a época)
+    conn.execute("UPDATE tarefas SET done_at = COALESCE(created_at, 0) WHERE concluida = 1 AND done_at IS NULL")
+    # O arquivador procura as concluídas mais antigas de todos os usuários
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tarefas_concluidas_em ON tarefas (done_at) WHERE concluida = 1
+    ''')
+
+
+def _v8_history_index(conn: sqlite3.Connection) -> None:
+    # /historico percorre as concluídas por (done_at, id) dentro do usuário;
+    # sem este índice cada página ordenava todas as concluídas ainda não arquivadas
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tarefas_historico
+        ON tarefas (user_id, done_at, id) WHERE concluida = 1
+    ''')
+
+
+def _v9_drop_completed_tasks_index(conn: sqlite3.Connection) -> None:
+    # A exportação das concluídas passou a ordenar por (done_at, id) e usa o
+    # idx_tarefas_historico; o índice da v6 só custava espaço e escritas
+    conn.execute("DROP INDEX IF EXISTS idx_tarefas_concluidas")
+
+
+MIGRATIONS = [
+    _v1_create_tarefas,
+    _v2_timestamps_and_pending_index,
+    _v3_conversation_persistence,
+    _v4_full_text_search,
+    _v5_due_dates_and_reminders,
+    _v6_completed_tasks_index,
+    _v7_archive,
+    _v8_history_index,
+    _v9_drop_completed_tasks_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Versão do schema gravada no banco."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Aplica as migrações pendentes e devolve a versão final do schema."""
+    version = current_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Banco na versão {version}, mas este código só conhece até a {SCHEMA_VERSION}."
+        )
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Outro processo pode ter migrado enquanto esperávamos o lock
+            if current_version(conn) >= number:
+                conn.execute("ROLLBACK")
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info("Migração %d aplicada: %s", number, migration.__name__)
+    return current_version(conn)
+
+
+# =============================================================================
+# VERIFICAÇÃO DOS PLANOS DAS CONSULTAS QUENTES
+# =============================================================================
+def check_query_plans(conn: sqlite3.Connection, queries: dict) -> list:
+    """Roda EXPLAIN QUERY PLAN nas consultas quentes e devolve as que não usam o índice esperado.
+
+    `queries` mapeia nome -> (sql, parâmetros de exemplo, nome do índice).
+    Também acusa as que ordenam numa B-tree temporária: usar o índice só para
+    filtrar e depois ordenar tudo custa proporcional ao tamanho do resultado.
+    """
+    problems = []
+    for name, (sql, params, index) in queries.items():
+        plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        if not any(index in detail for detail in plan) or any('TEMP B-TREE' in detail for detail in plan):
+            problems.append((name, plan))
+    return problems
@@ -4,65 +4,160 @@
 # BIBLIOTECAS (FERRAMENTAS)
 # =============================================================================
 import sqlite3
+import asyncio
 import logging
 import os
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    InputMediaPhoto,
+    InputMediaVideo,
+)
+from telegram.error import BadRequest, Forbidden
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
     filters,
 )
 
+import logs
+import metrics
+import transfer
+from archiver import Archiver
+from cache import LRUCache
+from concurrency import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from reminders import ReminderDispatcher
+from sender import BULK, SendScheduler
+from storage import TaskStorage
+
 # =============================================================================
 # CONFIGURAÇÃO E CONSTANTES
 # =============================================================================
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
-)
+# Logs: JSON por linha (LOG_FORMAT=text para o formato antigo), escritos num
+# thread separado; LOG_SAMPLE_EVERY=N guarda 1 a cada N eventos de alto volume
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', '10'))
+TASK_SAVED_LOG = "Tarefa salva com sucesso para o usuário %s"
+logs.setup_logging(LOG_LEVEL, LOG_FORMAT, sampling={TASK_SAVED_LOG: LOG_SAMPLE_EVERY})
+# O httpx registra cada chamada à Bot API em INFO; as métricas já cobrem isso
+logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # 🚨 TOKEN EMBUTIDO (APENAS PARA TESTE - NÃO USAR EM PRODUÇÃO) 🚨
 TELEGRAM_TOKEN = "8272131356:AAGi_CDSPoFDCEq53WhPorWH1NG5nKdAayA"
 
-DB_NAME = "tarefas.db"
+DB_NAME = os.environ.get('DB_NAME', 'tarefas.db')
+
+# Group commit das escritas (GROUP_COMMIT=1): junta inserts/updates concorrentes
+# numa única transação a cada poucos milissegundos
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '0') == '1'
+
+# COMPACT_DB_ON_START=1: converte um banco antigo para auto_vacuum incremental
+# na abertura (VACUUM completo; use numa janela de manutenção, com o bot parado)
+COMPACT_DB_ON_START = os.environ.get('COMPACT_DB_ON_START', '0') == '1'
+
+# SQLITE_SYNCHRONOUS=NORMAL troca a durabilidade de cada commit (fsync) por
+# velocidade; o padrão FULL garante que uma tarefa confirmada não se perde
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'FULL').upper()
+
+# Pool de conexões SQLite (as consultas rodam fora do event loop)
+storage = TaskStorage(
+    DB_NAME,
+    group_commit=GROUP_COMMIT,
+    convert_auto_vacuum=COMPACT_DB_ON_START,
+    synchronous=SQLITE_SYNCHRONOUS,
+)
+
+# Fila global de envio: limites do Telegram por chat/global e RetryAfter
+send_scheduler = SendScheduler()
+
+# Modo de recebimento de updates: "polling" (padrão, bom para desenvolvimento)
+# ou "webhook" (servidor HTTP local do próprio bot)
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # URL pública, ex.: https://meubot.com/telegram
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+
+# Quantos updates podem ser processados ao mesmo tempo (os de um mesmo
+# usuário continuam em ordem)
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '64'))
+
+# Limite por usuário: USER_RATE_LIMIT updates/s, com rajadas de até USER_BURST
+# (USER_RATE_LIMIT=0 desliga). Toques repetidos no mesmo botão ou no mesmo item
+# do menu, enquanto o primeiro ainda não terminou, viram uma execução só.
+USER_RATE_LIMIT = float(os.environ.get('USER_RATE_LIMIT', '1'))
+USER_BURST = int(os.environ.get('USER_BURST', '30'))
+MAIN_MENU_TEXTS = ("➕ Nova Tarefa", "📝 Minhas Tarefas", "❓ Sobre")
+RATE_LIMIT_NOTICE = "⏳ Muitas mensagens seguidas! Espere alguns segundos e envie de novo."
+update_processor = PerUserUpdateProcessor(
+    CONCURRENT_UPDATES,
+    rate=USER_RATE_LIMIT,
+    burst=USER_BURST,
+    coalesce_texts=MAIN_MENU_TEXTS,
+    rate_limit_notice=RATE_LIMIT_NOTICE,
+)
+
+# Processos workers (SHARDS > 1): um processo de entrada distribui os updates
+# por user_id entre N processos, cada um com o seu banco (ver sharding.py)
+SHARDS = int(os.environ.get('SHARDS', '1'))
+
+# Endpoint local de métricas do Prometheus (METRICS_PORT=0 desliga)
+METRICS_ADDR = os.environ.get('METRICS_ADDR', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9100'))
+
+# Fuso dos prazos digitados pelos usuários, em horas a partir do UTC (padrão: Brasília)
+BOT_UTC_OFFSET = int(os.environ.get('BOT_UTC_OFFSET', '-3'))
+BOT_TIMEZONE = timezone(timedelta(hours=BOT_UTC_OFFSET))
+
+# Lembretes dos prazos, despachados em lotes a partir do índice de prazos
+reminders = ReminderDispatcher(storage)
 
-# "Estados" da nossa conversa para adicionar tarefas
-GET_TITLE, GET_ATTACHMENT, GET_LINK = range(3)
+# Botões inline já atendidos em handle_attachment_choice: (chat, mensagem, callback_data).
+# Um segundo toque no mesmo botão da mesma mensagem não faz nada (nem salva a tarefa de novo)
+handled_callbacks = LRUCache(max_entries=50000, ttl=3600)
+
+# Concluídas há mais de N dias vão para o arquivo (continuam no /historico)
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+archiver = Archiver(storage, min_age=ARCHIVE_AFTER_DAYS * 86400)
+
+# "Estados" das conversas (adicionar tarefas e, por último, a importação)
+GET_TITLE, GET_ATTACHMENT, GET_LINK, GET_DUE, GET_IMPORT_FILE = range(5)
 
 # =============================================================================
 # BANCO DE DADOS (AGORA MAIS PODEROSO E SEGURO)
 # =============================================================================
 def setup_database():
-    """Cria/conecta ao DB e garante que a nova tabela de tarefas exista."""
+    """Cria/conecta ao DB e inicializa o pool de conexões (uma única vez)."""
     try:
         logger.info("Tentando criar/conectar ao banco de dados...")
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        logger.info("Conexão com banco estabelecida com sucesso")
-        
-        # ATUALIZAÇÃO: Nova tabela com colunas para anexos
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tarefas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                titulo TEXT NOT NULL,
-                tipo_anexo TEXT DEFAULT 'nenhum',
-                id_anexo TEXT,
-                concluida INTEGER DEFAULT 0
-            )
-        ''')
-        conn.commit()
-        conn.close()
-        logger.info(f"Banco de dados profissional '{DB_NAME}' pronto.")
+        # O pool cria a tabela de tarefas e mantém conexões WAL de longa duração
+        storage.open()
+        logger.info("Banco de dados profissional '%s' pronto.", DB_NAME)
     except sqlite3.Error as e:
-        logger.error(f"Erro SQLite ao configurar banco de dados: {e}")
+        logger.error("Erro SQLite ao configurar banco de dados: %s", e)
         raise
     except Exception as e:
-        logger.error(f"Erro geral ao configurar banco de dados: {e}")
+        logger.error("Erro geral ao configurar banco de dados: %s", e)
         raise
 
 # =============================================================================
@@ -89,6 +184,7 @@ def get_attachment_keyboard():
             InlineKeyboardButton("🔗 Link", callback_data='add_link')
         ],
         [
+            InlineKeyboardButton("📅 Prazo", callback_data='add_due'),
             InlineKeyboardButton("⏭️ Pular", callback_data='skip_attachment')
         ],
         [
@@ -122,7 +218,7 @@ Selecione uma opção abaixo para começar:"""
             reply_markup=get_main_keyboard(),
         )
     except Exception as e:
-        logger.error(f"Erro no comando start: {e}")
+        logger.error("Erro no comando start: %s", e)
         await update.message.reply_text("❌ Ocorreu um erro. Tente novamente mais tarde.")
 
 async def about(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -135,6 +231,10 @@ Este bot foi criado para ajudar você a organizar suas tarefas diárias de forma
 • Criar e gerenciar tarefas pessoais
 • Adicionar anexos (fotos, vídeos, links)
 • Marcar tarefas como concluídas
+• Definir prazos e receber lembretes
+• Buscar tarefas pelo título com /buscar
+• Consultar as tarefas concluídas com /historico
+• Exportar e importar tarefas com /exportar e /importar
 • Manter tudo organizado em um só lugar
 
 ✨ *Diferenciais:*
@@ -151,7 +251,7 @@ Desenvolvido com ❤️ para facilitar sua vida!"""
             reply_markup=get_main_keyboard()
         )
     except Exception as e:
-        logger.error(f"Erro no comando about: {e}")
+        logger.error("Erro no comando about: %s", e)
         await update.message.reply_text("❌ Ocorreu um erro. Tente novamente mais tarde.")
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -165,7 +265,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         context.user_data.clear()
         return ConversationHandler.END
     except Exception as e:
-        logger.error(f"Erro no comando cancel: {e}")
+        logger.error("Erro no comando cancel: %s", e)
         return ConversationHandler.END
 
 # =============================================================================
@@ -181,7 +281,7 @@ async def start_add_task(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return GET_TITLE
     except Exception as e:
-        logger.error(f"Erro ao iniciar adição de tarefa: {e}")
+        logger.error("Erro ao iniciar adição de tarefa: %s", e)
         await update.message.reply_text("❌ Ocorreu um erro. Tente novamente mais tarde.")
         return ConversationHandler.END
 
@@ -206,15 +306,23 @@ async def get_task_title(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return GET_ATTACHMENT
     except Exception as e:
-        logger.error(f"Erro ao receber título da tarefa: {e}")
+        logger.error("Erro ao receber título da tarefa: %s", e)
         await update.message.reply_text("❌ Ocorreu um erro. Tente novamente mais tarde.")
         return ConversationHandler.END
 
 async def handle_attachment_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Processa a escolha do tipo de anexo."""
+    idempotency_key = None
     try:
         query = update.callback_query
         await query.answer()
+
+        # Chave de idempotência: o mesmo botão da mesma mensagem só é atendido uma vez
+        idempotency_key = (query.message.chat_id, query.message.message_id, query.data)
+        if idempotency_key in handled_callbacks:
+            logger.info("Callback repetido ignorado: %s do usuário %s", query.data, update.effective_user.id)
+            return None
+        handled_callbacks.put(idempotency_key, True)
         
         if query.data == 'add_media':
             await query.edit_message_text(
@@ -235,6 +343,16 @@ async def handle_attachment_choice(update: Update, context: ContextTypes.DEFAULT
             )
             return GET_LINK
             
+        elif query.data == 'add_due':
+            await query.edit_message_text(
+                "📅 *Prazo da Tarefa*\n\nQuando devo te lembrar? Exemplos:\n"
+                "• `amanhã 9:00`\n• `hoje 18h`\n• `25/12 14:30`\n• `25/12/2026`\n\n"
+                " OU envie /cancelar para cancelar a operação.",
+                parse_mode='Markdown',
+                reply_markup=get_cancel_keyboard()
+            )
+            return GET_DUE
+
         elif query.data == 'skip_attachment':
             success = await save_task(update.effective_user.id, context)
             if success:
@@ -251,6 +369,8 @@ async def handle_attachment_choice(update: Update, context: ContextTypes.DEFAULT
                     reply_markup=get_main_keyboard()
                 )
             else:
+                # Deixa o usuário tentar de novo pelo mesmo botão
+                handled_callbacks.pop(idempotency_key)
                 await query.edit_message_text(
                     "❌ Erro ao salvar tarefa. Tente novamente.",
                     reply_markup=get_main_keyboard()
@@ -280,7 +400,10 @@ async def handle_attachment_choice(update: Update, context: ContextTypes.DEFAULT
             return ConversationHandler.END
             
     except Exception as e:
-        logger.error(f"Erro ao processar escolha de anexo: {e}")
+        logger.error("Erro ao processar escolha de anexo: %s", e)
+        # Falha no meio (ex.: timeout no edit_message_text): o botão volta a funcionar
+        if idempotency_key is not None:
+            handled_callbacks.pop(idempotency_key)
         if update.callback_query:
             await update.callback_query.edit_message_text("❌ Ocorreu um erro.")
         return ConversationHandler.END
@@ -291,32 +414,28 @@ async def save_task(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
         titulo = context.user_data.get('titulo')
         tipo_anexo = context.user_data.get('tipo_anexo', 'nenhum')
         id_anexo = context.user_data.get('id_anexo')
+        due_at = context.user_data.get('due_at')
         
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO tarefas (user_id, titulo, tipo_anexo, id_anexo) VALUES (?, ?, ?, ?)",
-            (user_id, titulo, tipo_anexo, id_anexo)
-        )
-        conn.commit()
-        conn.close()
+        task_id = await storage.add_task(user_id, titulo, tipo_anexo, id_anexo, due_at)
+        if due_at is not None:
+            reminders.schedule(task_id, due_at)
         
         # Limpa os dados da conversa
         context.user_data.clear()
-        logger.info(f"Tarefa salva com sucesso para o usuário {user_id}")
+        logger.info(TASK_SAVED_LOG, user_id)
         return True
     except sqlite3.Error as e:
-        logger.error(f"Erro ao salvar tarefa no banco de dados: {e}")
+        logger.error("Erro ao salvar tarefa no banco de dados: %s", e)
         return False
     except Exception as e:
-        logger.error(f"Erro inesperado ao salvar tarefa: {e}")
+        logger.error("Erro inesperado ao salvar tarefa: %s", e)
         return False
 
 async def get_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Recebe um anexo (foto ou vídeo) e salva a tarefa."""
     try:
-        # Verifica se o usuário quer cancelar
-        if update.message.text.startswith('/cancelar'):
+        # Verifica se o usuário quer cancelar (fotos e vídeos não têm texto)
+        if (update.message.text or '').startswith('/cancelar'):
             await update.message.reply_text(
                 "❌ Operação cancelada.", 
                 reply_markup=get_main_keyboard()
@@ -355,7 +474,7 @@ async def get_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
         return ConversationHandler.END
     except Exception as e:
-        logger.error(f"Erro ao receber anexo: {e}")
+        logger.error("Erro ao receber anexo: %s", e)
         await update.message.reply_text(
             "❌ Ocorreu um erro. Tente novamente mais tarde.",
             reply_markup=get_main_keyboard()
@@ -403,7 +522,84 @@ async def get_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
         return ConversationHandler.END
     except Exception as e:
-        logger.error(f"Erro ao receber link: {e}")
+        logger.error("Erro ao receber link: %s", e)
+        await update.message.reply_text(
+            "❌ Ocorreu um erro. Tente novamente mais tarde.",
+            reply_markup=get_main_keyboard()
+        )
+        return ConversationHandler.END
+
+# "amanhã 9:00", "hoje 18h", "25/12 14:30", "25/12/2026"
+DUE_DATE_PATTERN = re.compile(
+    r'^(?:(?P<dia_relativo>hoje|amanh[ãa])|(?P<dia>\d{1,2})/(?P<mes>\d{1,2})(?:/(?P<ano>\d{2,4}))?)'
+    r'(?:\s+(?:às\s+|as\s+)?(?P<hora>\d{1,2})(?:[:h](?P<minuto>\d{2})?)?)?$',
+    re.IGNORECASE
+)
+
+# Hora usada quando o usuário só informa o dia
+DEFAULT_DUE_HOUR = 9
+
+def parse_due_date(text: str, now: datetime):
+    """Converte o prazo digitado (no fuso do bot) em segundos UTC; None se for inválido."""
+    match = DUE_DATE_PATTERN.match(text.strip())
+    if not match:
+        return None
+    hour = int(match.group('hora')) if match.group('hora') else DEFAULT_DUE_HOUR
+    minute = int(match.group('minuto') or 0)
+    try:
+        if match.group('dia_relativo'):
+            day = now.date() + timedelta(days=0 if match.group('dia_relativo').lower() == 'hoje' else 1)
+            due = datetime(day.year, day.month, day.day, hour, minute, tzinfo=now.tzinfo)
+        else:
+            year = int(match.group('ano')) if match.group('ano') else now.year
+            if year < 100:
+                year += 2000
+            due = datetime(year, int(match.group('mes')), int(match.group('dia')), hour, minute, tzinfo=now.tzinfo)
+            if not match.group('ano') and due < now:
+                # "05/01" digitado em dezembro é do ano que vem
+                due = due.replace(year=year + 1)
+    except ValueError:
+        return None
+    return int(due.timestamp())
+
+def format_due(due_at: int) -> str:
+    """Prazo no fuso do bot, no formato dd/mm HH:MM."""
+    return datetime.fromtimestamp(due_at, BOT_TIMEZONE).strftime('%d/%m %H:%M')
+
+async def get_due_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Recebe o prazo da tarefa e volta para a escolha do anexo."""
+    try:
+        # Verifica se o usuário quer cancelar
+        if update.message.text.startswith('/cancelar'):
+            await update.message.reply_text(
+                "❌ Operação cancelada.", 
+                reply_markup=get_main_keyboard()
+            )
+            # Limpa os dados da conversa
+            context.user_data.clear()
+            return ConversationHandler.END
+
+        now = datetime.now(BOT_TIMEZONE)
+        due_at = parse_due_date(update.message.text, now)
+        if due_at is None or due_at <= now.timestamp():
+            await update.message.reply_text(
+                "❌ Não entendi esse prazo (ou ele já passou).\n\n"
+                "Tente algo como `amanhã 9:00` ou `25/12 14:30`.\n\n"
+                " OU envie /cancelar para cancelar a operação.",
+                parse_mode='Markdown',
+                reply_markup=get_cancel_keyboard()
+            )
+            return GET_DUE
+
+        context.user_data['due_at'] = due_at
+        await update.message.reply_text(
+            f"📅 Prazo definido: *{format_due(due_at)}*\n\nDeseja adicionar um anexo a esta tarefa?",
+            parse_mode='Markdown',
+            reply_markup=get_attachment_keyboard()
+        )
+        return GET_ATTACHMENT
+    except Exception as e:
+        logger.error("Erro ao receber prazo da tarefa: %s", e)
         await update.message.reply_text(
             "❌ Ocorreu um erro. Tente novamente mais tarde.",
             reply_markup=get_main_keyboard()
@@ -413,84 +609,864 @@ async def get_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 # =============================================================================
 # FUNCIONALIDADE: VER E GERENCIAR TAREFAS
 # =============================================================================
+TASKS_PER_PAGE = 10
+
+# Ícone de cada tipo de anexo na listagem
+ATTACHMENT_ICONS = {'foto': '🖼️', 'video': '🎬', 'link': '🔗'}
+
+# Uma página inteira vai numa mensagem só: títulos longos são encurtados para
+# não passar do limite do Telegram (que recusaria a página toda)
+MESSAGE_MAX_LENGTH = 4096
+TITLE_MAX_CHARS = 200
+# Legendas de foto/vídeo vão até 1024 caracteres; sobra espaço para o número/ícone
+CAPTION_TITLE_MAX_CHARS = 1000
+
+def short_title(titulo: str, limit: int = TITLE_MAX_CHARS) -> str:
+    """Título com no máximo `limit` caracteres (com "…" quando cortado), já escapado."""
+    if len(titulo) > limit:
+        titulo = titulo[:limit - 1].rstrip() + "…"
+    return escape_markdown(titulo)
+
+def fit_message(header: str, rows: list, render_line) -> str:
+    """Junta o cabeçalho e `render_line(linha, limite do título)` de cada linha.
+
+    Se o texto passar do limite de uma mensagem (contado em UTF-16, como faz o
+    Telegram), encurta mais os títulos até caber.
+    """
+    limit = TITLE_MAX_CHARS
+    while True:
+        text = "\n".join([header] + [render_line(row, limit) for row in rows])
+        if len(text.encode('utf-16-le')) // 2 <= MESSAGE_MAX_LENGTH or limit <= 16:
+            return text
+        limit //= 2
+
+def render_task_page(page, selected=None) -> tuple:
+    """Monta o texto e o teclado de uma página de tarefas pendentes.
+
+    Com `selected` (lista de ids), mostra a página no modo de seleção múltipla.
+    """
+    def render_line(row, limit):
+        number, tarefa = row
+        icon = ATTACHMENT_ICONS.get(tarefa['tipo_anexo'], '📝')
+        due = f" 📅 {format_due(tarefa['due_at'])}" if tarefa['due_at'] else ""
+        return f"{number}. {icon} {short_title(tarefa['titulo'], limit)}{due}"
+
+    text = fit_message(
+        f"📋 *Suas Tarefas Pendentes* ({page.total})\n", list(enumerate(page.rows, start=1)), render_line
+    )
+    keyboard = []
+    for number, tarefa in enumerate(page.rows, start=1):
+        task_id = tarefa['id']
+        icon = ATTACHMENT_ICONS.get(tarefa['tipo_anexo'], '📝')
+
+        if selected is not None:
+            mark = "☑️" if task_id in selected else "⬜"
+            keyboard.append([InlineKeyboardButton(f"{mark} {number}", callback_data=f"sel_{task_id}")])
+            continue
+
+        row = [
+            InlineKeyboardButton(f"✅ {number}", callback_data=f"done_{task_id}"),
+            InlineKeyboardButton(f"🗑️ {number}", callback_data=f"delete_{task_id}"),
+        ]
+        # Anexos só são enviados quando o usuário pede
+        if tarefa['tipo_anexo'] == 'link':
+            row.append(InlineKeyboardButton(f"🔗 {number}", url=tarefa['id_anexo']))
+        elif tarefa['tipo_anexo'] in ('foto', 'video'):
+            row.append(InlineKeyboardButton(f"{icon} {number}", callback_data=f"open_{task_id}"))
+        keyboard.append(row)
+
+    navigation = []
+    if page.has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"list_prev_{page.rows[0]['id']}"))
+    if page.has_next:
+        navigation.append(InlineKeyboardButton("Próxima ➡️", callback_data=f"list_next_{page.rows[-1]['id']}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    if selected is None:
+        keyboard.append([
+            InlineKeyboardButton("☑️ Selecionar", callback_data="sel_start"),
+            InlineKeyboardButton("🖼️ Galeria", callback_data="galeria_0"),
+        ])
+    else:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Concluir ({len(selected)})", callback_data="sel_done"),
+            InlineKeyboardButton(f"🗑️ Apagar ({len(selected)})", callback_data="sel_delete"),
+        ])
+        keyboard.append([
+            InlineKeyboardButton("✅ Concluir todas", callback_data="sel_all"),
+            InlineKeyboardButton("↩️ Sair", callback_data="sel_exit"),
+        ])
+
+    return text, InlineKeyboardMarkup(keyboard)
+
+EMPTY_LIST_TEXT = "🎉 *Parabéns!*\n\nVocê está em dia! Nenhuma tarefa pendente.\n\nContinue assim! ✨"
+
 async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Busca as tarefas no DB e as envia uma por uma com botões."""
+    """Mostra a primeira página das tarefas pendentes numa única mensagem."""
     try:
         user_id = update.effective_user.id
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, titulo, tipo_anexo, id_anexo FROM tarefas WHERE user_id = ? AND concluida = 0", (user_id,))
-        tarefas = cursor.fetchall()
-        conn.close()
-
-        if not tarefas:
+        page = await storage.pending_page(user_id, limit=TASKS_PER_PAGE)
+
+        if not page.rows:
             await update.message.reply_text(
-                "🎉 *Parabéns!*\n\nVocê está em dia! Nenhuma tarefa pendente.\n\nContinue assim! ✨",
+                EMPTY_LIST_TEXT,
                 parse_mode='Markdown',
                 reply_markup=get_main_keyboard()
             )
             return
 
+        text, reply_markup = render_task_page(page)
         await update.message.reply_text(
-            "📋 *Suas Tarefas Pendentes*\n\nAqui estão as tarefas que você precisa completar:",
-            parse_mode='Markdown'
+            text,
+            parse_mode='Markdown',
+            reply_markup=reply_markup
         )
-        
-        for tarefa in tarefas:
-            task_id = tarefa['id']
-            keyboard = [
-                [
-                    InlineKeyboardButton("✅ Concluir", callback_data=f"done_{task_id}"),
-                    InlineKeyboardButton("🗑️ Apagar", callback_data=f"delete_{task_id}"),
-                ]
-            ]
-            # Se houver um link, adiciona um botão para ele
-            if tarefa['tipo_anexo'] == 'link':
-                keyboard.insert(0, [InlineKeyboardButton("🔗 Abrir Link", url=tarefa['id_anexo'])])
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            # Envia o anexo se existir, ou apenas o texto
-            try:
-                if tarefa['tipo_anexo'] == 'foto':
-                    await context.bot.send_photo(
-                        chat_id=user_id, 
-                        photo=tarefa['id_anexo'], 
-                        caption=f"📝 *{tarefa['titulo']}*",
-                        parse_mode='Markdown',
-                        reply_markup=reply_markup
-                    )
-                elif tarefa['tipo_anexo'] == 'video':
-                    await context.bot.send_video(
-                        chat_id=user_id, 
-                        video=tarefa['id_anexo'], 
-                        caption=f"📝 *{tarefa['titulo']}*",
-                        parse_mode='Markdown',
-                        reply_markup=reply_markup
-                    )
-                else:
-                    await context.bot.send_message(
-                        chat_id=user_id, 
-                        text=f"📝 *{tarefa['titulo']}*",
-                        parse_mode='Markdown',
-                        reply_markup=reply_markup
-                    )
-            except Exception as e:
-                logger.error(f"Erro ao enviar tarefa {task_id}: {e}")
-                await context.bot.send_message(
-                    chat_id=user_id, 
-                    text=f"❌ Erro ao carregar tarefa: *{tarefa['titulo']}*",
-                    parse_mode='Markdown'
-                )
-                
+
+    except sqlite3.Error as e:
+        logger.error("Erro ao buscar tarefas do banco de dados: %s", e)
+        await update.message.reply_text(
+            "❌ Erro ao buscar tarefas. Tente novamente mais tarde.",
+            reply_markup=get_main_keyboard()
+        )
+    except Exception as e:
+        logger.error("Erro inesperado ao listar tarefas: %s", e)
+        await update.message.reply_text(
+            "❌ Ocorreu um erro. Tente novamente mais tarde.",
+            reply_markup=get_main_keyboard()
+        )
+
+async def show_task_page(query, user_id: int, after_id: int = None, before_id: int = None, selected=None) -> None:
+    """Edita a mensagem da listagem no lugar com a página pedida."""
+    page = await storage.pending_page(user_id, after_id=after_id, before_id=before_id, limit=TASKS_PER_PAGE)
+    if not page.rows:
+        await query.edit_message_text(EMPTY_LIST_TEXT, parse_mode='Markdown')
+        return
+    text, reply_markup = render_task_page(page, selected)
+    try:
+        await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    except BadRequest as e:
+        # Clique repetido na mesma página: nada mudou na mensagem
+        if 'not modified' not in str(e):
+            raise
+
+async def handle_task_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Navega entre as páginas da listagem (botões ⬅️/➡️)."""
+    query = update.callback_query
+    try:
+        await query.answer()
+        _, direction, task_id = query.data.split('_')
+        selected = context.user_data.get('selecao')
+        if direction == 'next':
+            await show_task_page(query, update.effective_user.id, after_id=int(task_id), selected=selected)
+        else:
+            await show_task_page(query, update.effective_user.id, before_id=int(task_id), selected=selected)
+    except Exception as e:
+        logger.error("Erro ao trocar de página: %s", e)
+        await query.edit_message_text("❌ Erro ao carregar tarefas. Tente novamente.")
+
+def current_page_anchor(query):
+    """Id a partir do qual a página exibida na mensagem começa (para redesenhá-la)."""
+    markup = query.message.reply_markup if query.message else None
+    for row in (markup.inline_keyboard if markup else ()):
+        for button in row:
+            match = re.match(r'^(done|delete|sel)_(\d+)$', button.callback_data or '')
+            if match:
+                return int(match.group(2)) - 1
+    return None
+
+async def handle_task_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Conclui ou apaga uma tarefa (botões ✅/🗑️) e atualiza a mesma mensagem."""
+    query = update.callback_query
+    try:
+        action, task_id = query.data.split('_')
+        user_id = update.effective_user.id
+        if action == 'done':
+            changed = await storage.complete(user_id, int(task_id))
+            feedback = "✅ Tarefa concluída!"
+        else:
+            changed = await storage.delete(user_id, int(task_id))
+            feedback = "🗑️ Tarefa apagada!"
+        await query.answer(feedback if changed else "Tarefa não encontrada.")
+        if is_control_message(query):
+            await remove_control_item(query, int(task_id))
+        else:
+            await show_task_page(query, user_id, after_id=current_page_anchor(query))
     except sqlite3.Error as e:
-        logger.error(f"Erro ao buscar tarefas do banco de dados: {e}")
+        logger.error("Erro ao atualizar tarefa no banco de dados: %s", e)
+        await query.answer("❌ Erro ao atualizar tarefa. Tente novamente.", show_alert=True)
+    except Exception as e:
+        logger.error("Erro inesperado ao atualizar tarefa: %s", e)
+        await query.answer("❌ Ocorreu um erro.", show_alert=True)
+
+async def handle_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Modo de seleção múltipla: marcar tarefas e concluir/apagar todas de uma vez."""
+    query = update.callback_query
+    try:
+        user_id = update.effective_user.id
+        command = query.data.split('_', 1)[1]
+        selected = context.user_data.get('selecao')
+        anchor = current_page_anchor(query)
+        feedback = None
+
+        if command == 'start':
+            selected = context.user_data['selecao'] = []
+        elif command == 'exit':
+            context.user_data.pop('selecao', None)
+            selected = None
+        elif selected is None:
+            # Botão de uma mensagem antiga, de antes de sair do modo de seleção
+            feedback = "A seleção expirou. Toque em ☑️ Selecionar novamente."
+        elif command.isdigit():
+            task_id = int(command)
+            if task_id in selected:
+                selected.remove(task_id)
+            else:
+                selected.append(task_id)
+        else:
+            if command == 'all':
+                changed = await storage.complete_all(user_id)
+                feedback = f"✅ {len(changed)} tarefa(s) concluída(s)!"
+            elif not selected:
+                feedback = "Nenhuma tarefa selecionada."
+            elif command == 'done':
+                changed = await storage.complete_many(user_id, selected)
+                feedback = f"✅ {len(changed)} tarefa(s) concluída(s)!"
+            else:
+                changed = await storage.delete_many(user_id, selected)
+                feedback = f"🗑️ {len(changed)} tarefa(s) apagada(s)!"
+            if command == 'all' or selected:
+                context.user_data.pop('selecao', None)
+                selected = None
+
+        await query.answer(feedback)
+        await show_task_page(query, user_id, after_id=anchor, selected=selected)
+    except sqlite3.Error as e:
+        logger.error("Erro ao atualizar tarefas selecionadas: %s", e)
+        await query.answer("❌ Erro ao atualizar tarefas. Tente novamente.", show_alert=True)
+    except Exception as e:
+        logger.error("Erro inesperado no modo de seleção: %s", e)
+        await query.answer("❌ Ocorreu um erro.", show_alert=True)
+
+async def open_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Envia a foto/vídeo de uma tarefa quando o usuário pede."""
+    query = update.callback_query
+    try:
+        task_id = int(query.data.split('_')[1])
+        tarefa = await storage.get_task(update.effective_user.id, task_id)
+        if tarefa is None:
+            await query.answer("Tarefa não encontrada.", show_alert=True)
+            return
+        await query.answer()
+
+        caption = f"📝 *{short_title(tarefa['titulo'], CAPTION_TITLE_MAX_CHARS)}*"
+        if tarefa['tipo_anexo'] == 'foto':
+            message = await context.bot.send_photo(
+                chat_id=update.effective_chat.id,
+                photo=tarefa['id_anexo'],
+                caption=caption,
+                parse_mode='Markdown'
+            )
+        elif tarefa['tipo_anexo'] == 'video':
+            message = await context.bot.send_video(
+                chat_id=update.effective_chat.id,
+                video=tarefa['id_anexo'],
+                caption=caption,
+                parse_mode='Markdown'
+            )
+        else:
+            return
+
+        # Anexo guardado como URL: fica com o file_id para não baixar de novo
+        if not is_telegram_file_id(tarefa['id_anexo']):
+            file_id = returned_file_id(message)
+            if file_id:
+                await storage.update_attachment_ids(update.effective_user.id, {task_id: file_id})
+    except Exception as e:
+        logger.error("Erro ao abrir anexo da tarefa: %s", e)
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Erro ao carregar anexo. Tente novamente."
+        )
+
+# =============================================================================
+# FUNCIONALIDADE: GALERIA DE ANEXOS (ÁLBUNS COM SENDMEDIAGROUP)
+# =============================================================================
+# Até 10 fotos/vídeos por álbum (limite do sendMediaGroup)
+GALLERY_ALBUM_SIZE = 10
+
+GALLERY_HEADER = "🖼️ Galeria"
+
+def is_control_message(query) -> bool:
+    """Indica se o botão veio de uma mensagem avulsa (galeria ou lembrete), não da listagem."""
+    text = (query.message.text or '') if query.message else ''
+    return text.startswith((GALLERY_HEADER, REMINDER_HEADER))
+
+async def remove_control_item(query, task_id: int) -> None:
+    """Tira da mensagem avulsa os botões de uma tarefa já concluída/apagada."""
+    targets = (f"done_{task_id}", f"delete_{task_id}")
+    keyboard = [
+        [button for button in row if button.callback_data not in targets]
+        for row in query.message.reply_markup.inline_keyboard
+    ]
+    await query.edit_message_reply_markup(InlineKeyboardMarkup([row for row in keyboard if row]))
+
+def is_telegram_file_id(id_anexo: str) -> bool:
+    """O id_anexo já é um file_id do Telegram (e não uma URL a ser baixada)."""
+    return not id_anexo.startswith(('http://', 'https://'))
+
+def returned_file_id(message):
+    """file_id que o Telegram devolveu para a foto/vídeo enviada."""
+    if message.photo:
+        return message.photo[-1].file_id
+    if message.video:
+        return message.video.file_id
+    return None
+
+async def show_gallery(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Envia as fotos/vídeos das tarefas em álbuns, seguidos de uma mensagem de controle."""
+    query = update.callback_query
+    try:
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+        after_id = int(query.data.split('_')[1])
+        rows, has_more = await storage.pending_media(user_id, after_id=after_id, limit=GALLERY_ALBUM_SIZE)
+        if not rows:
+            await query.answer("Nenhuma tarefa pendente com foto ou vídeo.", show_alert=True)
+            return
+        await query.answer()
+
+        media = []
+        for number, tarefa in enumerate(rows, start=1):
+            caption = f"{number}. {short_title(tarefa['titulo'], CAPTION_TITLE_MAX_CHARS)}"
+            media_class = InputMediaPhoto if tarefa['tipo_anexo'] == 'foto' else InputMediaVideo
+            media.append(media_class(tarefa['id_anexo'], caption=caption, parse_mode='Markdown'))
+
+        # O sendMediaGroup exige pelo menos 2 itens
+        if len(media) == 1:
+            if rows[0]['tipo_anexo'] == 'foto':
+                messages = [await context.bot.send_photo(
+                    chat_id, rows[0]['id_anexo'], caption=media[0].caption, parse_mode='Markdown'
+                )]
+            else:
+                messages = [await context.bot.send_video(
+                    chat_id, rows[0]['id_anexo'], caption=media[0].caption, parse_mode='Markdown'
+                )]
+        else:
+            messages = await context.bot.send_media_group(chat_id, media)
+
+        # Guarda o file_id devolvido para nunca reenviar a mesma mídia por URL.
+        # Um file_id guardado fica como está: o Telegram devolve outra string
+        # para o mesmo arquivo a cada envio, e regravar a página inteira não ganha nada
+        new_ids = {}
+        for tarefa, message in zip(rows, messages):
+            if is_telegram_file_id(tarefa['id_anexo']):
+                continue
+            file_id = returned_file_id(message)
+            if file_id:
+                new_ids[tarefa['id']] = file_id
+        await storage.update_attachment_ids(user_id, new_ids)
+
+        keyboard = []
+        for start in range(0, len(rows), 2):
+            row = []
+            for number, tarefa in enumerate(rows[start:start + 2], start=start + 1):
+                row.append(InlineKeyboardButton(f"✅ {number}", callback_data=f"done_{tarefa['id']}"))
+                row.append(InlineKeyboardButton(f"🗑️ {number}", callback_data=f"delete_{tarefa['id']}"))
+            keyboard.append(row)
+        navigation = [InlineKeyboardButton("📋 Lista", callback_data="list_next_0")]
+        if has_more:
+            navigation.append(InlineKeyboardButton("Próximas ➡️", callback_data=f"galeria_{rows[-1]['id']}"))
+        keyboard.append(navigation)
+
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"{GALLERY_HEADER}: {len(rows)} tarefa(s) acima. Use os números das legendas:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    except Exception as e:
+        logger.error("Erro ao montar galeria: %s", e)
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Erro ao carregar a galeria. Tente novamente."
+        )
+
+# =============================================================================
+# FUNCIONALIDADE: LEMBRETES DE PRAZO
+# =============================================================================
+REMINDER_HEADER = "⏰ Lembrete"
+
+async def send_reminder(bot, tarefa: dict) -> None:
+    """Envia o lembrete de uma tarefa (chamado pelo ReminderDispatcher).
+
+    Erros definitivos (usuário bloqueou o bot, chat inexistente) contam como
+    entregues; qualquer outro erro sobe e o lembrete é tentado de novo.
+    """
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Concluir", callback_data=f"done_{tarefa['id']}"),
+        InlineKeyboardButton("🗑️ Apagar", callback_data=f"delete_{tarefa['id']}"),
+    ]])
+    try:
+        await bot.send_message(
+            chat_id=tarefa['user_id'],
+            text=f"{REMINDER_HEADER}: {escape_markdown(tarefa['titulo'])}\n\n📅 Prazo: *{format_due(tarefa['due_at'])}*",
+            parse_mode='Markdown',
+            reply_markup=keyboard,
+            rate_limit_args={'priority': BULK},
+        )
+    except (Forbidden, BadRequest) as e:
+        logger.info("Lembrete da tarefa %s descartado: %s", tarefa['id'], e)
+
+# =============================================================================
+# FUNCIONALIDADE: BUSCAR TAREFAS (/buscar E MODO INLINE)
+# =============================================================================
+SEARCH_PAGE_SIZE = 10
+
+def render_search_page(termo: str, rows: list, offset: int, has_more: bool) -> tuple:
+    """Monta o texto e o teclado de uma página de resultados da busca."""
+    def render_line(row, limit):
+        number, tarefa = row
+        icon = ATTACHMENT_ICONS.get(tarefa['tipo_anexo'], '📝')
+        return f"{number}. {icon} {short_title(tarefa['titulo'], limit)}"
+
+    text = fit_message(
+        f"🔎 *Resultados para:* {short_title(termo)}\n", list(enumerate(rows, start=offset + 1)), render_line
+    )
+    keyboard = []
+    for number, tarefa in enumerate(rows, start=offset + 1):
+        icon = ATTACHMENT_ICONS.get(tarefa['tipo_anexo'], '📝')
+        if tarefa['tipo_anexo'] == 'link':
+            keyboard.append([InlineKeyboardButton(f"🔗 {number}", url=tarefa['id_anexo'])])
+        elif tarefa['tipo_anexo'] in ('foto', 'video'):
+            keyboard.append([InlineKeyboardButton(f"{icon} {number}", callback_data=f"open_{tarefa['id']}")])
+
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"busca_{max(0, offset - SEARCH_PAGE_SIZE)}"))
+    if has_more:
+        navigation.append(InlineKeyboardButton("Próxima ➡️", callback_data=f"busca_{offset + SEARCH_PAGE_SIZE}"))
+    if navigation:
+        keyboard.append(navigation)
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def search_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/buscar <termo>: procura nos títulos das tarefas pendentes."""
+    try:
+        termo = " ".join(context.args).strip()
+        if not termo:
+            await update.message.reply_text(
+                "🔎 Use: /buscar <termo>\n\nExemplo: /buscar mercado",
+                reply_markup=get_main_keyboard()
+            )
+            return
+
+        rows, has_more = await storage.search(update.effective_user.id, termo, limit=SEARCH_PAGE_SIZE)
+        if not rows:
+            await update.message.reply_text(
+                f"🔎 Nenhuma tarefa pendente encontrada para: *{escape_markdown(termo)}*",
+                parse_mode='Markdown',
+                reply_markup=get_main_keyboard()
+            )
+            return
+
+        # Guarda o termo para a paginação pelos botões
+        context.user_data['busca'] = termo
+        text, reply_markup = render_search_page(termo, rows, 0, has_more)
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Erro ao buscar tarefas: %s", e)
         await update.message.reply_text(
             "❌ Erro ao buscar tarefas. Tente novamente mais tarde.",
             reply_markup=get_main_keyboard()
         )
+
+async def handle_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Navega entre as páginas de resultados da busca."""
+    query = update.callback_query
+    try:
+        termo = context.user_data.get('busca')
+        if not termo:
+            await query.answer("A busca expirou. Use /buscar novamente.", show_alert=True)
+            return
+        await query.answer()
+        offset = int(query.data.split('_')[1])
+        rows, has_more = await storage.search(update.effective_user.id, termo, limit=SEARCH_PAGE_SIZE, offset=offset)
+        text, reply_markup = render_search_page(termo, rows, offset, has_more)
+        await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Erro ao paginar busca: %s", e)
+        await query.edit_message_text("❌ Erro ao buscar tarefas. Tente novamente.")
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Modo inline (@bot termo): lista as tarefas pendentes que combinam com o termo."""
+    inline_query = update.inline_query
+    try:
+        offset = int(inline_query.offset or 0)
+        rows, has_more = await storage.search(
+            update.effective_user.id, inline_query.query, limit=SEARCH_PAGE_SIZE, offset=offset
+        )
+        results = [
+            InlineQueryResultArticle(
+                id=str(tarefa['id']),
+                title=tarefa['titulo'],
+                description=ATTACHMENT_ICONS.get(tarefa['tipo_anexo'], '📝'),
+                input_message_content=InputTextMessageContent(f"📝 {tarefa['titulo']}"),
+            )
+            for tarefa in rows
+        ]
+        await inline_query.answer(
+            results,
+            cache_time=0,
+            is_personal=True,
+            next_offset=str(offset + SEARCH_PAGE_SIZE) if has_more else '',
+        )
     except Exception as e:
-        logger.error(f"Erro inesperado ao listar tarefas: {e}")
+        logger.error("Erro na busca inline: %s", e)
+
+# =============================================================================
+# FUNCIONALIDADE: HISTÓRICO DE CONCLUÍDAS (/historico)
+# =============================================================================
+# Junta as concluídas recentes e as já arquivadas, da mais nova para a mais
+# antiga. A paginação é por (done_at, id) da última linha, então o custo de
+# uma página não cresce com o tamanho do histórico.
+HISTORY_PAGE_SIZE = 10
+
+def format_done(done_at: int) -> str:
+    """Data de conclusão no fuso do bot, no formato dd/mm/aaaa."""
+    # Concluídas antes de existir o done_at ficaram com 0 (ver migração v7)
+    if not done_at:
+        return "data desconhecida"
+    return datetime.fromtimestamp(done_at, BOT_TIMEZONE).strftime('%d/%m/%Y')
+
+def render_history_page(rows: list, has_more: bool, first_page: bool) -> tuple:
+    """Monta o texto e o teclado de uma página do histórico."""
+    def render_line(tarefa, limit):
+        icon = ATTACHMENT_ICONS.get(tarefa['tipo_anexo'], '📝')
+        return f"{icon} {short_title(tarefa['titulo'], limit)} — {format_done(tarefa['done_at'])}"
+
+    text = fit_message("✅ *Tarefas concluídas*\n", rows, render_line)
+
+    navigation = []
+    if not first_page:
+        navigation.append(InlineKeyboardButton("🔝 Início", callback_data="hist_inicio"))
+    if has_more:
+        last = rows[-1]
+        navigation.append(InlineKeyboardButton("Mais antigas ➡️", callback_data=f"hist_{last['done_at']}_{last['id']}"))
+    return text, InlineKeyboardMarkup([navigation] if navigation else [])
+
+async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/historico: lista as tarefas concluídas, inclusive as arquivadas."""
+    try:
+        rows, has_more = await storage.history_page(update.effective_user.id, limit=HISTORY_PAGE_SIZE)
+        if not rows:
+            await update.message.reply_text(
+                "✅ Você ainda não concluiu nenhuma tarefa.",
+                reply_markup=get_main_keyboard()
+            )
+            return
+        text, reply_markup = render_history_page(rows, has_more, first_page=True)
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Erro ao mostrar histórico: %s", e)
+        await update.message.reply_text(
+            "❌ Erro ao carregar o histórico. Tente novamente mais tarde.",
+            reply_markup=get_main_keyboard()
+        )
+
+async def handle_history_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Navega pelo histórico (mais antigas / volta ao início)."""
+    query = update.callback_query
+    try:
+        await query.answer()
+        anchor = query.data.split('_')[1:]
+        before = None if anchor == ['inicio'] else (int(anchor[0]), int(anchor[1]))
+        rows, has_more = await storage.history_page(update.effective_user.id, before, limit=HISTORY_PAGE_SIZE)
+        if not rows:
+            await query.edit_message_text("✅ Não há mais tarefas concluídas.")
+            return
+        text, reply_markup = render_history_page(rows, has_more, first_page=before is None)
+        await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Erro ao paginar histórico: %s", e)
+        await query.edit_message_text("❌ Erro ao carregar o histórico. Tente novamente.")
+
+# =============================================================================
+# FUNCIONALIDADE: EXPORTAR E IMPORTAR TAREFAS
+# =============================================================================
+# Limite de download de arquivos da Bot API
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+MAX_IMPORT_ROWS = 100000
+# Tarefas por transação (um executemany cada)
+IMPORT_CHUNK_SIZE = 1000
+# Intervalo mínimo entre duas edições da mensagem de progresso
+IMPORT_PROGRESS_INTERVAL = 2
+
+async def export_user_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Envia todas as tarefas do usuário num arquivo (/exportar [csv|json])."""
+    try:
+        fmt = context.args[0].lower() if context.args else 'csv'
+        if fmt not in transfer.EXPORT_FORMATS:
+            await update.message.reply_text("📤 Use /exportar csv ou /exportar json.")
+            return
+        # O arquivo é montado em disco; a memória só guarda um lote de linhas por vez
+        with tempfile.NamedTemporaryFile(suffix=f".{fmt}") as output:
+            total = await storage.export_tasks(update.effective_user.id, fmt, output)
+            if not total:
+                await update.message.reply_text(
+                    "📭 Você ainda não tem tarefas para exportar.",
+                    reply_markup=get_main_keyboard()
+                )
+                return
+            output.seek(0)
+            await update.message.reply_document(
+                document=output,
+                filename=f"tarefas.{fmt}",
+                caption=f"📤 {total} tarefa(s) exportada(s).",
+                write_timeout=120,
+            )
+    except Exception as e:
+        logger.error("Erro ao exportar tarefas: %s", e)
+        await update.message.reply_text("❌ Erro ao exportar tarefas. Tente novamente mais tarde.")
+
+async def start_import(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Pede o arquivo a importar (/importar)."""
+    await update.message.reply_text(
+        "📥 *Importar Tarefas*\n\nEnvie um arquivo `.csv` ou `.json` no formato do /exportar "
+        "(só a coluna `titulo` é obrigatória).\n\n OU envie /cancelar para cancelar a operação.",
+        parse_mode='Markdown',
+        reply_markup=get_cancel_keyboard()
+    )
+    return GET_IMPORT_FILE
+
+async def receive_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Importa o arquivo em lotes, editando uma única mensagem de progresso."""
+    document = update.message.document
+    fmt = transfer.import_format(document.file_name)
+    if fmt is None:
         await update.message.reply_text(
-            "❌ Ocorreu um erro. Te
+            "❌ Envie um arquivo .csv ou .json.\n\n OU envie /cancelar para cancelar a operação.",
+            reply_markup=get_cancel_keyboard()
+        )
+        return GET_IMPORT_FILE
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text("❌ Arquivo grande demais (máximo de 20 MB).", reply_markup=get_main_keyboard())
+        return ConversationHandler.END
+
+    user_id = update.effective_user.id
+    progress = await update.message.reply_text("📥 Importando...")
+    imported = ignored = 0
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"importacao.{fmt}")
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_drive(path)
+
+            chunks = transfer.import_chunks(path, fmt, IMPORT_CHUNK_SIZE, MAX_IMPORT_ROWS)
+            last_edit = time.monotonic()
+            while True:
+                # A leitura/validação do arquivo também fica fora do event loop
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                rows, invalid = chunk
+                imported += await storage.import_tasks(user_id, rows)
+                ignored += invalid
+                if time.monotonic() - last_edit >= IMPORT_PROGRESS_INTERVAL:
+                    await progress.edit_text(f"📥 Importando... {imported} tarefa(s) até agora.")
+                    last_edit = time.monotonic()
+    except ValueError as e:
+        await progress.edit_text(f"❌ Arquivo inválido: {e}.\n\n{imported} tarefa(s) importada(s) antes do erro.")
+        return ConversationHandler.END
+    except Exception as e:
+        logger.error("Erro ao importar tarefas: %s", e)
+        await progress.edit_text(f"❌ Erro ao importar.\n\n{imported} tarefa(s) importada(s) antes do erro.")
+        return ConversationHandler.END
+
+    summary = f"✅ Importação concluída: {imported} tarefa(s) importada(s)."
+    if ignored:
+        summary += f"\n⚠️ {ignored} linha(s) ignorada(s) (sem título ou com anexo inválido)."
+    await progress.edit_text(summary)
+    logger.info("%s tarefas importadas para o usuário %s", imported, user_id)
+    return ConversationHandler.END
+
+async def cancel_import(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Sai da importação pelo botão ❌ Cancelar."""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text("❌ Operação cancelada.")
+    return ConversationHandler.END
+
+# =============================================================================
+# INICIALIZAÇÃO DO BOT
+# =============================================================================
+async def post_init(application: Application) -> None:
+    """Tarefas de fundo que começam junto com o bot."""
+    # Indexa para a busca as tarefas criadas antes do índice FTS existir
+    application.create_task(storage.backfill_search_index())
+    reminders.start(lambda tarefa: send_reminder(application.bot, tarefa))
+    archiver.start()
+
+async def post_shutdown(application: Application) -> None:
+    """Grava as escritas pendentes e fecha o pool de conexões do banco ao desligar o bot."""
+    await reminders.stop()
+    await archiver.stop()
+    await storage.flush()
+    storage.close()
+
+def collect_runtime_metrics() -> list:
+    """Medidas da fila de envio, do cache de pendentes e da admissão de updates para o /metrics."""
+    queue = send_scheduler.metrics()
+    cache = storage.cache_metrics()
+    admission = update_processor.metrics()
+    samples = [
+        ('bot_send_queue_depth', 'gauge', {'priority': priority}, depth)
+        for priority, depth in queue['queue_depth'].items()
+    ]
+    for priority, waits in queue['wait_seconds'].items():
+        samples.append(('bot_send_wait_seconds_total', 'counter', {'priority': priority}, waits['total']))
+        samples.append(('bot_send_wait_seconds_max', 'gauge', {'priority': priority}, waits['max']))
+    samples.append(('bot_send_chat_waiting', 'gauge', {}, queue['chat_waiting']))
+    samples.append(('bot_send_retry_after_total', 'counter', {}, queue['retry_after']))
+    for name in ('hits', 'misses', 'evictions', 'expirations'):
+        samples.append((f'bot_cache_{name}_total', 'counter', {}, cache[name]))
+    samples.append(('bot_cache_size', 'gauge', {}, cache['size']))
+    samples.append(('bot_updates_rejected_total', 'counter', {}, admission['rejected']))
+    samples.append(('bot_updates_coalesced_total', 'counter', {}, admission['coalesced']))
+    samples.append(('bot_updates_inflight_actions', 'gauge', {}, admission['inflight']))
+    samples.append(('bot_rate_limit_buckets', 'gauge', {}, admission['buckets']))
+    return samples
+
+def default_builder():
+    """Builder com o token do bot e as chamadas à Bot API instrumentadas."""
+    return (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .request(metrics.InstrumentedRequest(connection_pool_size=256))
+    )
+
+def build_application(builder=None, rate_limit: bool = True) -> Application:
+    """Monta o Application com todos os handlers.
+
+    `builder` permite trocar o token/URL da Bot API (ex.: benchmarks contra
+    um servidor local); `rate_limit=False` desliga a fila de envio.
+    """
+    if builder is None:
+        builder = default_builder()
+    if rate_limit:
+        builder = builder.rate_limiter(send_scheduler)
+
+    persistence = SQLitePersistence(storage)
+    application = (
+        builder
+        .concurrent_updates(update_processor)
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    # O user_data do Application é um defaultdict que nunca encolhe; a
+    # persistência tira dele as chaves dos usuários ociosos
+    persistence.user_data_store = application._user_data
+
+    # Fluxo de adicionar tarefa
+    add_task_handler = ConversationHandler(
+        entry_points=[MessageHandler(filters.Regex('^➕ Nova Tarefa$'), start_add_task)],
+        states={
+            GET_TITLE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_task_title),
+            ],
+            GET_ATTACHMENT: [
+                CallbackQueryHandler(
+                    handle_attachment_choice,
+                    pattern='^(add_media|add_link|add_due|skip_attachment|back_to_title|cancel_operation)$'
+                ),
+                MessageHandler(filters.PHOTO | filters.VIDEO, get_attachment),
+            ],
+            GET_LINK: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_link),
+            ],
+            GET_DUE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_due_date),
+            ],
+        },
+        fallbacks=[
+            CommandHandler('cancelar', cancel),
+            CallbackQueryHandler(handle_attachment_choice, pattern='^cancel_operation$'),
+        ],
+        # Estado da conversa sobrevive a restarts (ver persistence.py)
+        name='nova_tarefa',
+        persistent=True,
+    )
+
+    # Importação: /importar e depois o arquivo
+    import_handler = ConversationHandler(
+        entry_points=[CommandHandler('importar', start_import)],
+        states={
+            GET_IMPORT_FILE: [
+                MessageHandler(filters.Document.ALL, receive_import_file),
+            ],
+        },
+        fallbacks=[
+            CommandHandler('cancelar', cancel),
+            CallbackQueryHandler(cancel_import, pattern='^cancel_operation$'),
+        ],
+        name='importar',
+        persistent=True,
+    )
+
+    application.add_handler(CommandHandler('start', start))
+    application.add_handler(add_task_handler)
+    application.add_handler(import_handler)
+    application.add_handler(MessageHandler(filters.Regex('^📝 Minhas Tarefas$'), list_tasks))
+    application.add_handler(CallbackQueryHandler(handle_task_page, pattern=r'^list_(next|prev)_\d+$'))
+    application.add_handler(CallbackQueryHandler(open_attachment, pattern=r'^open_\d+$'))
+    application.add_handler(CallbackQueryHandler(handle_task_action, pattern=r'^(done|delete)_\d+$'))
+    application.add_handler(CallbackQueryHandler(handle_selection, pattern=r'^sel_(start|exit|done|delete|all|\d+)$'))
+    application.add_handler(MessageHandler(filters.Regex('^❓ Sobre$'), about))
+    application.add_handler(CallbackQueryHandler(show_gallery, pattern=r'^galeria_\d+$'))
+    application.add_handler(CommandHandler('buscar', search_tasks))
+    application.add_handler(CallbackQueryHandler(handle_search_page, pattern=r'^busca_\d+$'))
+    application.add_handler(InlineQueryHandler(inline_search))
+    application.add_handler(CommandHandler('historico', show_history))
+    application.add_handler(CallbackQueryHandler(handle_history_page, pattern=r'^hist_(inicio|\d+_\d+)$'))
+    application.add_handler(CommandHandler('exportar', export_user_tasks))
+
+    # Latência/erros de todos os handlers acima e tempo das consultas ao banco
+    metrics.instrument_application(application)
+    storage.query_observer = metrics.observe_query
+    metrics.add_collector(collect_runtime_metrics)
+    return application
+
+def main() -> None:
+    """Configura o bot e começa a receber updates."""
+    # Antes do desvio para os shards: o ingress também usa a configuração do webhook
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook exige a variável WEBHOOK_URL.")
+
+    if SHARDS > 1:
+        import sharding
+        # Os workers abrem os bancos dos shards; aqui só o ingress
+        sharding.run(sys.modules[__name__], SHARDS)
+        return
+
+    setup_database()
+    application = build_application()
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, METRICS_ADDR)
+
+    if BOT_MODE == 'webhook':
+        logger.info("Bot iniciado em modo webhook na porta %s. Aguardando mensagens...", WEBHOOK_PORT)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        logger.info("Bot iniciado. Aguardando mensagens...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+if __name__ == '__main__':
+    main()
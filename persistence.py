@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# PERSISTÊNCIA DAS CONVERSAS NO TAREFAS.DB
+# =============================================================================
+# Guarda o `context.user_data` (titulo/tipo_anexo/id_anexo do fluxo de nova
+# tarefa) e os estados dos ConversationHandlers nas tabelas `user_data` e
+# `conversas`, para que um deploy/restart não perca conversas pela metade.
+#
+#   - leitura preguiçosa: nada de user_data é lido na inicialização; cada
+#     usuário é carregado no primeiro update dele (refresh_user_data);
+#   - escrita em lote: o Application chama update_* a cada `update_interval`
+#     segundos só para quem mudou; tudo isso vira uma única transação;
+#   - memória limitada: usuários ociosos saem da memória (inclusive do
+#     user_data do Application) e são lidos de novo do banco se voltarem.
+#
+# Os estados de conversa são lidos inteiros na inicialização (o
+# ConversationHandler exige), mas a tabela só guarda conversas em andamento:
+# as encerradas são apagadas e as abandonadas expiram após `conversation_ttl`.
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistência de user_data e conversas usando o pool do TaskStorage."""
+
+    def __init__(
+        self,
+        storage,
+        update_interval: float = 5,
+        idle_timeout: float = 1800,
+        max_loaded_users: int = 50000,
+        conversation_ttl: float = 7 * 24 * 3600,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.storage = storage
+        self.idle_timeout = idle_timeout
+        self.max_loaded_users = max_loaded_users
+        self.conversation_ttl = conversation_ttl
+        # user_id -> (último acesso, dict do user_data carregado)
+        self._loaded = OrderedDict()
+        # Alterações ainda não gravadas
+        self._dirty_users = {}
+        self._dirty_conversations = {}
+        self._pending_write = None
+        # O dict user_id -> user_data do Application (ver build_application)
+        self.user_data_store = None
+
+    # -------------------------------------------------------------------------
+    # Leitura
+    # -------------------------------------------------------------------------
+    async def get_user_data(self) -> dict:
+        # Carregamento preguiçoso em refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self.storage.write(_load_conversations, name, int(time.time() - self.conversation_ttl))
+        return {tuple(json.loads(chave)): json.loads(estado) for chave, estado in rows}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        """Chamado antes de cada handler: carrega o usuário do banco no primeiro acesso."""
+        now = time.monotonic()
+        if user_id in self._loaded:
+            self._loaded[user_id] = (now, user_data)
+            self._loaded.move_to_end(user_id)
+            return
+
+        row = await self.storage.read(_load_user_data, user_id)
+        if row is not None and user_id not in self._dirty_users:
+            # O que já está na memória (se houver) é mais novo que o banco
+            for key, value in json.loads(row).items():
+                user_data.setdefault(key, value)
+        self._evict_idle(now)
+        self._loaded[user_id] = (now, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    def _evict_idle(self, now: float) -> None:
+        """Descarrega da memória os usuários ociosos (já gravados no banco)."""
+        # Só descarrega quem ficou parado bem mais que o intervalo de gravação
+        min_idle = 2 * self.update_interval
+        loaded = len(self._loaded)
+        evicted = []
+        for user_id, (last_seen, user_data) in self._loaded.items():
+            idle = now - last_seen
+            over_limit = loaded > self.max_loaded_users
+            if idle < self.idle_timeout and not (over_limit and idle > min_idle):
+                # Ordem de último acesso: daqui em diante todos são mais recentes
+                break
+            if user_id in self._dirty_users:
+                # Ainda não gravado: fica para uma próxima rodada
+                continue
+            evicted.append((user_id, user_data))
+            loaded -= 1
+
+        for user_id, user_data in evicted:
+            del self._loaded[user_id]
+            user_data.clear()
+            # Tira a chave do defaultdict do Application, senão sobra uma
+            # entrada (vazia) para cada usuário que já passou pelo bot
+            if self.user_data_store is not None and self.user_data_store.get(user_id) is user_data:
+                del self.user_data_store[user_id]
+
+    # -------------------------------------------------------------------------
+    # Escrita em lote
+    # -------------------------------------------------------------------------
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._dirty_users[user_id] = data
+        await self._write_soon()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._dirty_users[user_id] = None
+        self._loaded.pop(user_id, None)
+        await self._write_soon()
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self._dirty_conversations[(name, json.dumps(list(key)))] = new_state
+        await self._write_soon()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def _write_soon(self) -> None:
+        """Junta todas as chamadas update_* da mesma rodada numa única transação."""
+        if self._pending_write is None or self._pending_write.done():
+            self._pending_write = asyncio.ensure_future(self._write_dirty())
+        await asyncio.shield(self._pending_write)
+
+    async def _write_dirty(self) -> None:
+        # Deixa as outras chamadas da mesma rodada (asyncio.gather) entrarem no lote
+        await asyncio.sleep(0)
+        self._pending_write = None
+        users, self._dirty_users = self._dirty_users, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        if not users and not conversations:
+            return
+
+        user_rows = []
+        for user_id, data in users.items():
+            if data is None:
+                user_rows.append((user_id, None))
+                continue
+            try:
+                user_rows.append((user_id, json.dumps(data)))
+            except (TypeError, ValueError) as e:
+                logger.error("user_data do usuário %s não é serializável: %s", user_id, e)
+        conversation_rows = [
+            (name, chave, None if state is None else json.dumps(state))
+            for (name, chave), state in conversations.items()
+        ]
+        try:
+            await self.storage.write(_save_batch, user_rows, conversation_rows)
+        except Exception:
+            # Devolve para a próxima rodada sem sobrescrever alterações mais novas
+            for user_id, data in users.items():
+                self._dirty_users.setdefault(user_id, data)
+            for key, state in conversations.items():
+                self._dirty_conversations.setdefault(key, state)
+            raise
+
+    async def flush(self) -> None:
+        """Grava o que ainda estiver pendente (chamado no desligamento)."""
+        if self._pending_write is not None:
+            await asyncio.gather(self._pending_write, return_exceptions=True)
+        await self._write_dirty()
+
+
+# =============================================================================
+# CONSULTAS (RODAM NOS THREADS DO TASKSTORAGE)
+# =============================================================================
+def _load_user_data(conn, user_id):
+    row = conn.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _load_conversations(conn, name, expired_before):
+    conn.execute("DELETE FROM conversas WHERE nome = ? AND updated_at < ?", (name, expired_before))
+    return conn.execute("SELECT chave, estado FROM conversas WHERE nome = ?", (name,)).fetchall()
+
+
+def _save_batch(conn, user_rows, conversation_rows):
+    now = int(time.time())
+    # user_data apagado ou vazio não precisa ocupar linha
+    conn.executemany(
+        "DELETE FROM user_data WHERE user_id = ?",
+        [(user_id,) for user_id, data in user_rows if data in (None, '{}')]
+    )
+    conn.executemany(
+        "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+        [(user_id, data, now) for user_id, data in user_rows if data not in (None, '{}')]
+    )
+    conn.executemany(
+        "DELETE FROM conversas WHERE nome = ? AND chave = ?",
+        [(name, chave) for name, chave, estado in conversation_rows if estado is None]
+    )
+    conn.executemany(
+        "INSERT INTO conversas (nome, chave, estado, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(nome, chave) DO UPDATE SET estado = excluded.estado, updated_at = excluded.updated_at",
+        [(name, chave, estado, now) for name, chave, estado in conversation_rows if estado is not None]
+    )
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# DESPACHANTE DE LEMBRETES (PRAZOS DAS TAREFAS)
+# =============================================================================
+# Nada de um job do JobQueue por tarefa: o banco é a fonte da verdade e o
+# despachante só olha para frente uma janela curta de cada vez.
+#
+#   - a cada `lookahead` segundos, uma consulta pelo índice parcial
+#     idx_tarefas_lembretes traz (due_at, id) da próxima janela, no máximo
+#     `max_heap` linhas; esse heap serve só para saber quando acordar;
+#   - ao acordar, os lembretes vencidos são reservados em lotes com um único
+#     UPDATE ... RETURNING (reminder_lease), enviados e marcados com
+#     reminded_at. Uma reserva de um processo que caiu no meio do envio expira
+#     depois de `lease` segundos e o lembrete é enviado de novo;
+#   - tarefas novas com prazo dentro da janela entram no heap por schedule().
+#
+# Depois de um restart, tudo o que venceu enquanto o bot estava fora sai na
+# primeira rodada. A única janela para um lembrete duplicado é o bot cair
+# entre a resposta do Telegram e a gravação do reminded_at.
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ReminderDispatcher:
+    """Envia os lembretes vencidos em lotes, guiado pelo índice de prazos."""
+
+    def __init__(
+        self,
+        storage,
+        batch_size: int = 100,
+        lookahead: float = 60,
+        max_heap: int = 10000,
+        lease: float = 120,
+        retry_delay: float = 60,
+    ):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.lookahead = lookahead
+        self.max_heap = max_heap
+        self.lease = lease
+        self.retry_delay = retry_delay
+        # (due_at, task_id) dos lembretes da janela atual
+        self._heap = []
+        self._window_end = 0
+        self._wakeup = asyncio.Event()
+        self._deliver = None
+        self._task = None
+
+    def start(self, deliver) -> None:
+        """Começa a despachar; `deliver(tarefa)` envia um lembrete (exceção = tentar depois)."""
+        if self._task is not None:
+            return
+        self._deliver = deliver
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Para o laço; reservas em andamento expiram e são retomadas no próximo start."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def schedule(self, task_id: int, due_at: int) -> None:
+        """Avisa de uma tarefa nova com prazo; só entra no heap se cair na janela atual."""
+        if self._task is None or due_at >= self._window_end:
+            return
+        heapq.heappush(self._heap, (due_at, task_id))
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._dispatch_due()
+                if time.time() >= self._window_end:
+                    await self._load_window()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Erro no despachante de lembretes: %s", e)
+                self._window_end = time.time() + self.retry_delay
+            await self._sleep()
+
+    async def _dispatch_due(self) -> None:
+        """Reserva e envia, em lotes, todos os lembretes já vencidos."""
+        while True:
+            now = int(time.time())
+            rows = await self.storage.claim_due_reminders(now, now + int(self.lease), self.batch_size)
+            if not rows:
+                return
+            results = await asyncio.gather(*(self._deliver(row) for row in rows), return_exceptions=True)
+            sent, retry = [], []
+            for row, result in zip(rows, results):
+                if isinstance(result, Exception):
+                    logger.warning("Lembrete da tarefa %s não enviado: %s", row['id'], result)
+                    retry.append(row['id'])
+                else:
+                    sent.append(row['id'])
+            await self.storage.finish_reminders(sent, retry, int(time.time() + self.retry_delay))
+            logger.info("Lembretes: %d enviados, %d para tentar de novo", len(sent), len(retry))
+            if len(rows) < self.batch_size:
+                return
+
+    async def _load_window(self) -> None:
+        """Carrega (due_at, id) dos lembretes que vencem até o fim da próxima janela."""
+        now = time.time()
+        window_end = now + self.lookahead
+        upcoming = await self.storage.upcoming_reminders(int(window_end), self.max_heap)
+        if len(upcoming) >= self.max_heap:
+            # Janela cheia: encurta até o último prazo carregado
+            window_end = upcoming[-1][0]
+        # Já vem ordenado por prazo, então já é um heap válido
+        self._heap = upcoming
+        self._window_end = window_end
+
+    async def _sleep(self) -> None:
+        """Dorme até o próximo prazo do heap, o fim da janela ou um schedule()."""
+        now = time.time()
+        # Vencidos já passaram por _dispatch_due (ou estão reservados/adiados)
+        while self._heap and self._heap[0][0] <= now:
+            heapq.heappop(self._heap)
+        wake_at = min(self._heap[0][0], self._window_end) if self._heap else self._window_end
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, wake_at - now))
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# FILA GLOBAL DE ENVIO (LIMITES DO TELEGRAM E RETRYAFTER)
+# =============================================================================
+# Todas as chamadas à Bot API com `chat_id` (send_*, reply_text, edit_*)
+# passam por aqui, porque o SendScheduler é plugado como `rate_limiter` do
+# Application. Os handlers continuam chamando `context.bot.send_*` normalmente.
+#
+#   - limite por chat: ~1 msg/s em conversas privadas, 20/min em grupos;
+#   - balde global (~30 msg/s) com fila de prioridade: respostas interativas
+#     passam na frente dos envios em massa;
+#   - um RetryAfter (429) pausa todos os envios pelo tempo pedido e a chamada
+#     é repetida, em vez de virar mensagem de erro para o usuário.
+#
+# Envios em massa marcam a prioridade com:
+#     await context.bot.send_message(..., rate_limit_args={'priority': BULK})
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Prioridades (menor número sai primeiro)
+INTERACTIVE = 0
+BULK = 1
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+
+class TokenBucket:
+    """Balde de fichas simples; `rate` fichas por segundo, até `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def _refill(self, now: float) -> None:
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Segundos até haver uma ficha disponível (0 se já houver)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def reserve(self, now: float) -> float:
+        """Reserva a próxima ficha (mesmo que futura) e devolve quanto esperar por ela."""
+        self.take(now)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class SendScheduler(BaseRateLimiter):
+    """Rate limiter do bot: limites por chat, balde global com prioridade e RetryAfter."""
+
+    def __init__(
+        self,
+        overall_rate: float = 30,
+        private_rate: float = 1,
+        private_burst: float = 3,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3,
+        max_retries: int = 3,
+        max_tracked_chats: int = 10000,
+    ):
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_tracked_chats = max_tracked_chats
+
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self._chat_buckets = OrderedDict()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher = None
+
+        # Métricas
+        self._chat_waiting = 0
+        self._retry_after_count = 0
+        self._wait_stats = {
+            priority: {'count': 0, 'total': 0.0, 'max': 0.0} for priority in PRIORITY_NAMES
+        }
+
+    # -------------------------------------------------------------------------
+    # Ciclo de vida (chamado pelo ExtBot)
+    # -------------------------------------------------------------------------
+    async def initialize(self) -> None:
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future in self._queue:
+            if not future.done():
+                future.cancel()
+        self._queue.clear()
+
+    # -------------------------------------------------------------------------
+    # Métricas
+    # -------------------------------------------------------------------------
+    def metrics(self) -> dict:
+        """Profundidade das filas e tempos de espera, por prioridade."""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._queue:
+            if not future.done():
+                depth[PRIORITY_NAMES[priority]] += 1
+        waits = {}
+        for priority, stats in self._wait_stats.items():
+            average = stats['total'] / stats['count'] if stats['count'] else 0.0
+            waits[PRIORITY_NAMES[priority]] = dict(stats, avg=average)
+        return {
+            'queue_depth': depth,
+            'chat_waiting': self._chat_waiting,
+            'retry_after': self._retry_after_count,
+            'wait_seconds': waits,
+        }
+
+    def _record_wait(self, priority: int, seconds: float) -> None:
+        stats = self._wait_stats[priority]
+        stats['count'] += 1
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+
+    # -------------------------------------------------------------------------
+    # Limites
+    # -------------------------------------------------------------------------
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Grupos/canais têm id negativo ou @username
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._chat_buckets[chat_id] = bucket
+            # Esquece os chats ociosos (balde cheio) mais antigos
+            while len(self._chat_buckets) > self.max_tracked_chats:
+                oldest_id, oldest = next(iter(self._chat_buckets.items()))
+                if not oldest.is_full(now):
+                    break
+                del self._chat_buckets[oldest_id]
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_pause(self) -> None:
+        loop = asyncio.get_running_loop()
+        while (delay := self._paused_until - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, chat_id, priority: int) -> None:
+        loop = asyncio.get_running_loop()
+
+        delay = self._chat_bucket(chat_id, loop.time()).reserve(loop.time())
+        if delay > 0:
+            self._chat_waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._chat_waiting -= 1
+
+        # Caminho rápido: ninguém na fila e há ficha global
+        now = loop.time()
+        if not self._queue and self._paused_until <= now and self._overall.wait_time(now) == 0:
+            self._overall.take(now)
+            return
+
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self) -> None:
+        """Libera a fila global em ordem de prioridade, respeitando o balde e pausas."""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Descarta quem desistiu de esperar
+            while self._queue and self._queue[0][2].done():
+                heapq.heappop(self._queue)
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = loop.time()
+            delay = max(self._paused_until - now, self._overall.wait_time(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            self._overall.take(now)
+            _, _, future = heapq.heappop(self._queue)
+            future.set_result(None)
+
+    # -------------------------------------------------------------------------
+    # Ponto de entrada do ExtBot
+    # -------------------------------------------------------------------------
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """Aplica os limites antes de cada chamada e repete após RetryAfter.
+
+        `rate_limit_args` aceita um dict com `priority` (INTERACTIVE/BULK) e
+        `max_retries`.
+        """
+        options = rate_limit_args or {}
+        priority = options.get('priority', INTERACTIVE)
+        max_retries = options.get('max_retries', self.max_retries)
+        chat_id = data.get('chat_id')
+        if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+            chat_id = int(chat_id)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for attempt in range(max_retries + 1):
+            if chat_id is not None:
+                await self._acquire(chat_id, priority)
+            else:
+                await self._wait_pause()
+            if attempt == 0:
+                self._record_wait(priority, loop.time() - started)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._retry_after_count += 1
+                if attempt == max_retries:
+                    logger.error("Limite do Telegram atingido em %s após %d tentativas", endpoint, attempt + 1)
+                    raise
+                pause = float(e.retry_after) + 0.1
+                self._paused_until = max(self._paused_until, loop.time() + pause)
+                logger.warning("RetryAfter em %s: pausando envios por %.1fs", endpoint, pause)
+        return None
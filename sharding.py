@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# MODO MULTIPROCESSO: UM PROCESSO DE ENTRADA E N WORKERS POR USER_ID
+# =============================================================================
+# Com SHARDS=N (N > 1), `python minhastarefinhasbot.py` vira o processo de
+# entrada (ingress): ele só recebe os updates (polling ou webhook, pelo
+# Updater do PTB) e repassa cada um, já serializado, para o worker
+# `user_id % N`. Cada worker é um processo com o Application completo
+# (handlers, conversas, cache, lembretes) e o seu próprio banco:
+#
+#   tarefas.db  ->  tarefas-shard0.db, tarefas-shard1.db, ...
+#
+# Como todos os dados de um usuário (tarefas, arquivo, user_data, conversas)
+# moram no shard dele, cada banco tem exatamente um processo escritor e os
+# workers não disputam o lock de escrita do SQLite. Os updates de um usuário
+# sempre caem no mesmo worker, na ordem de chegada (e o
+# PerUserUpdateProcessor mantém essa ordem lá dentro).
+#
+# Na primeira subida com shards, um tarefas.db existente é dividido entre os
+# bancos dos shards e renomeado para tarefas.db.antes-dos-shards. Mudar N
+# depois exige redistribuir os dados à mão; o ingress se recusa a subir se
+# encontrar bancos de um número diferente de shards.
+#
+# Supervisão: um worker que morre é recriado com espera exponencial (até
+# `max_backoff` segundos se ele continuar caindo logo após subir). Os updates
+# que ainda estavam na fila dele passam para a fila do novo processo.
+import asyncio
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sqlite3
+import time
+
+import migrations
+
+logger = logging.getLogger(__name__)
+
+# Um worker que ficou de pé por mais que isso volta a ser reiniciado sem espera
+STABLE_AFTER = 30
+
+
+def shard_of(user_id: int, shards: int) -> int:
+    """Shard de um usuário (o mesmo `user_id % N` usado para dividir o banco)."""
+    return user_id % shards
+
+
+def shard_db_name(db_name: str, shard: int) -> str:
+    """tarefas.db -> tarefas-shard0.db"""
+    base, extension = os.path.splitext(db_name)
+    return f"{base}-shard{shard}{extension}"
+
+
+def routing_id(update) -> int:
+    """Usuário do update (ou o chat, se não houver usuário) para escolher o shard."""
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return abs(update.effective_chat.id)
+    return 0
+
+
+# =============================================================================
+# DIVISÃO DO BANCO ÚNICO ENTRE OS SHARDS
+# =============================================================================
+def prepare_databases(db_name: str, shards: int) -> None:
+    """Confere os bancos dos shards e, na primeira vez, divide o banco único entre eles."""
+    base, extension = os.path.splitext(db_name)
+    existing = glob.glob(f"{glob.escape(base)}-shard*{extension}")
+    expected = {shard_db_name(db_name, shard) for shard in range(shards)}
+    if existing and set(existing) != expected:
+        raise RuntimeError(
+            f"Encontrados {len(existing)} bancos de shard para SHARDS={shards}; "
+            "mudar o número de shards exige redistribuir os dados antes."
+        )
+    if existing or not os.path.exists(db_name):
+        return
+    split_database(db_name, shards)
+
+
+def split_database(db_name: str, shards: int) -> None:
+    """Copia os dados de cada usuário do banco único para o banco do shard dele."""
+    source = sqlite3.connect(db_name)
+    try:
+        migrations.migrate(source)
+        conversations = source.execute("SELECT nome, chave, estado, updated_at FROM conversas").fetchall()
+        columns = ", ".join(row[1] for row in source.execute("PRAGMA table_info(tarefas)"))
+        for shard in range(shards):
+            target = sqlite3.connect(shard_db_name(db_name, shard))
+            try:
+                # Banco novo: já nasce com o auto_vacuum incremental do TaskStorage
+                target.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                migrations.migrate(target)
+                target.execute("ATTACH DATABASE ? AS origem", (db_name,))
+                with target:
+                    # Os gatilhos do índice de busca indexam as pendentes copiadas
+                    target.execute(
+                        f"INSERT INTO tarefas ({columns}) SELECT {columns} FROM origem.tarefas "
+                        "WHERE user_id % ? = ?",
+                        (shards, shard)
+                    )
+                    target.execute(
+                        "INSERT INTO tarefas_arquivo SELECT * FROM origem.tarefas_arquivo WHERE user_id % ? = ?",
+                        (shards, shard)
+                    )
+                    target.execute(
+                        "INSERT INTO user_data SELECT * FROM origem.user_data WHERE user_id % ? = ?",
+                        (shards, shard)
+                    )
+                    # Chave da conversa: JSON [chat_id, user_id]
+                    target.executemany(
+                        "INSERT INTO conversas (nome, chave, estado, updated_at) VALUES (?, ?, ?, ?)",
+                        [row for row in conversations if shard_of(json.loads(row[1])[-1], shards) == shard]
+                    )
+                target.execute("DETACH DATABASE origem")
+            finally:
+                target.close()
+        source.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        source.close()
+    os.replace(db_name, f"{db_name}.antes-dos-shards")
+    logger.info("Banco '%s' dividido em %d shards", db_name, shards)
+
+
+# =============================================================================
+# WORKER
+# =============================================================================
+def worker_main(shard: int, shards: int, updates) -> None:
+    """Processo worker: o bot completo, alimentado pela fila do seu shard."""
+    # Ctrl+C chega ao grupo inteiro; quem decide o desligamento é o ingress
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # O bot lê a configuração na importação
+    os.environ['DB_NAME'] = shard_db_name(os.environ.get('DB_NAME', 'tarefas.db'), shard)
+    import metrics
+    import minhastarefinhasbot as bot
+    from sender import SendScheduler
+
+    # O limite global de envio do Telegram é do bot inteiro: cada worker fica com 1/N
+    bot.send_scheduler = SendScheduler(overall_rate=30 / shards)
+    bot.setup_database()
+    if bot.METRICS_PORT:
+        metrics.start_http_server(bot.METRICS_PORT + 1 + shard, bot.METRICS_ADDR)
+    asyncio.run(_serve_shard(bot, shard, updates))
+
+
+async def _serve_shard(bot, shard: int, updates) -> None:
+    from telegram import Update
+
+    application = bot.build_application(bot.default_builder().updater(None))
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+    logger.info("Worker do shard %d pronto (banco %s)", shard, bot.DB_NAME)
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await bot.post_shutdown(application)
+        logger.info("Worker do shard %d encerrado", shard)
+
+
+# =============================================================================
+# INGRESS E SUPERVISÃO
+# =============================================================================
+class ShardSupervisor:
+    """Mantém os N workers vivos e entrega cada update na fila do shard certo."""
+
+    def __init__(self, shards: int, min_backoff: float = 1, max_backoff: float = 60, target=worker_main):
+        self.shards = shards
+        # Função de entrada dos workers: target(shard, shards, fila)
+        self.target = target
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # 'spawn': os workers não herdam threads/sockets do ingress
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue() for _ in range(shards)]
+        self._processes = [None] * shards
+        self._started_at = [0.0] * shards
+        self._backoff = [0.0] * shards
+        self._restart_at = [0.0] * shards
+        self._stopping = False
+
+    def start(self) -> None:
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+    def _spawn(self, shard: int) -> None:
+        process = self._context.Process(
+            target=self.target,
+            args=(shard, self.shards, self._queues[shard]),
+            name=f"shard-{shard}",
+        )
+        process.start()
+        self._processes[shard] = process
+        self._started_at[shard] = time.monotonic()
+
+    def route(self, update) -> None:
+        """Serializa o update e o coloca na fila do worker do usuário."""
+        shard = shard_of(routing_id(update), self.shards)
+        self._queues[shard].put(update.to_dict())
+
+    def check(self) -> None:
+        """Reinicia os workers que morreram (com espera se estiverem caindo em sequência)."""
+        if self._stopping:
+            return
+        now = time.monotonic()
+        for shard, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            if not self._restart_at[shard]:
+                uptime = now - self._started_at[shard]
+                if uptime >= STABLE_AFTER:
+                    self._backoff[shard] = 0.0
+                else:
+                    self._backoff[shard] = min(self.max_backoff, max(self.min_backoff, 2 * self._backoff[shard]))
+                self._restart_at[shard] = now + self._backoff[shard]
+                logger.error(
+                    "Worker do shard %d saiu com código %s; reiniciando em %.0fs",
+                    shard, process.exitcode, self._backoff[shard]
+                )
+            if now >= self._restart_at[shard]:
+                self._restart_at[shard] = 0.0
+                self._replace_queue(shard)
+                self._spawn(shard)
+
+    def _replace_queue(self, shard: int) -> None:
+        """Fila nova para o novo worker, com o que o anterior não chegou a ler.
+
+        Um processo morto à força pode deixar o lock de leitura da fila preso;
+        por isso a fila não é reaproveitada e a leitura usa timeout.
+        """
+        old, new = self._queues[shard], self._context.Queue()
+        moved = 0
+        while True:
+            try:
+                new.put(old.get(timeout=0.05))
+            except queue.Empty:
+                break
+            moved += 1
+        old.close()
+        self._queues[shard] = new
+        if moved:
+            logger.info("%d updates repassados para o novo worker do shard %d", moved, shard)
+
+    def stop(self, timeout: float = 30) -> None:
+        """Pede para cada worker terminar o que já recebeu e espera por eles."""
+        self._stopping = True
+        for updates in self._queues:
+            updates.put(None)
+        deadline = time.monotonic() + timeout
+        for shard, process in enumerate(self._processes):
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker do shard %d não terminou a tempo; encerrando à força", shard)
+                process.terminate()
+                process.join()
+
+
+async def _run_ingress(bot, supervisor: ShardSupervisor) -> None:
+    from telegram import Bot, Update
+    from telegram.ext import Updater
+
+    update_queue = asyncio.Queue()
+    updater = Updater(Bot(bot.TELEGRAM_TOKEN), update_queue)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    async def supervise():
+        while not stop.is_set():
+            supervisor.check()
+            await asyncio.sleep(1)
+
+    async def forward():
+        while True:
+            supervisor.route(await update_queue.get())
+
+    async with updater:
+        if bot.BOT_MODE == 'webhook':
+            await updater.start_webhook(
+                listen=bot.WEBHOOK_LISTEN,
+                port=bot.WEBHOOK_PORT,
+                url_path=bot.WEBHOOK_PATH,
+                webhook_url=bot.WEBHOOK_URL,
+                secret_token=bot.WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        else:
+            await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        tasks = [asyncio.ensure_future(supervise()), asyncio.ensure_future(forward())]
+        await stop.wait()
+        await updater.stop()
+        # Entrega o que o Updater já tinha buscado antes de avisar os workers
+        while not update_queue.empty():
+            supervisor.route(update_queue.get_nowait())
+        for task in tasks:
+            task.cancel()
+
+
+def run(bot, shards: int) -> None:
+    """Sobe o ingress e os `shards` workers (chamado pelo main() do bot)."""
+    prepare_databases(bot.DB_NAME, shards)
+    supervisor = ShardSupervisor(shards)
+    supervisor.start()
+    logger.info("Ingress iniciado com %d workers. Aguardando mensagens...", shards)
+    try:
+        asyncio.run(_run_ingress(bot, supervisor))
+    finally:
+        supervisor.stop()
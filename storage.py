@@ -0,0 +1,891 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# CAMADA DE ARMAZENAMENTO (SQLITE FORA DO EVENT LOOP)
+# =============================================================================
+# O sqlite3 é bloqueante: cada execute/commit chamado dentro de um handler
+# async trava o loop inteiro do Application. Aqui todas as consultas rodam em
+# threads dedicadas, cada uma com a sua conexão de longa duração em modo WAL:
+#   - um único thread de escrita (o SQLite só aceita um escritor por vez);
+#   - um pequeno pool de threads de leitura (WAL permite leituras em paralelo
+#     com a escrita).
+# Os handlers só fazem `await` nos métodos de TaskStorage.
+#
+# As tarefas pendentes de cada usuário ficam num cache LRU com TTL (lido no
+# primeiro acesso e atualizado no lugar pelas escritas), então a listagem
+# normalmente nem chega ao banco.
+#
+# Modo opcional de group commit: as escritas de vários handlers são juntadas
+# numa única transação a cada poucos milissegundos (ou a cada N operações).
+# Cada operação roda no seu SAVEPOINT, então quem aguarda recebe o próprio
+# resultado/erro, e só depois do COMMIT (synchronous=FULL, um fsync por lote).
+import asyncio
+import bisect
+import heapq
+import itertools
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import migrations
+import transfer
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Marca no cache os usuários com pendentes demais para guardar, para que cada
+# tela não releia `max_cached_rows + 1` linhas só para descobrir isso de novo
+_OVERSIZED = object()
+
+
+class TaskPage(NamedTuple):
+    """Uma página de tarefas pendentes (paginação por id)."""
+    rows: list
+    has_prev: bool
+    has_next: bool
+    total: int
+
+
+def _connect(db_name: str, synchronous: str = 'FULL') -> sqlite3.Connection:
+    """Abre uma conexão já configurada para uso concorrente."""
+    conn = sqlite3.connect(db_name, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    # FULL por padrão: com WAL, NORMAL não corrompe o banco, mas uma queda de
+    # energia pode desfazer commits já respondidos ao usuário (ver SQLITE_SYNCHRONOUS)
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class TaskStorage:
+    """Pool de conexões SQLite com API awaitable para as tarefas."""
+
+    def __init__(
+        self,
+        db_name: str,
+        read_pool_size: int = 4,
+        cache_size: int = 10000,
+        cache_ttl: float = 300,
+        max_cached_rows: int = 1000,
+        group_commit: bool = False,
+        batch_window: float = 0.005,
+        batch_size: int = 128,
+        convert_auto_vacuum: bool = False,
+        synchronous: str = 'FULL',
+    ):
+        self.db_name = db_name
+        # FULL: um commit respondido ("✅ Tarefa salva") sobrevive a queda de
+        # energia. NORMAL (opt-in) poupa o fsync, mas pode perder os últimos commits
+        self.synchronous = synchronous
+        # Converter um banco existente para auto_vacuum incremental exige um
+        # VACUUM completo (lock exclusivo, o dobro do espaço): só quando pedido
+        self.convert_auto_vacuum = convert_auto_vacuum
+        # Modo de auto_vacuum do banco depois do open() (2 = INCREMENTAL)
+        self.auto_vacuum = None
+        self.read_pool_size = read_pool_size
+        # Pendentes por user_id; usuários com mais de `max_cached_rows` ficam
+        # com a marca _OVERSIZED (some no TTL ou quando uma remoção pode
+        # trazê-los de volta abaixo do limite)
+        self.cache = LRUCache(max_entries=cache_size, ttl=cache_ttl)
+        self.max_cached_rows = max_cached_rows
+        self._loading = {}
+        # Opcional: função(kind, nome da consulta, segundos) chamada após cada consulta
+        self.query_observer = None
+        # Última consulta pedida pelos handlers (o arquivador espera o banco ficar ocioso)
+        self.last_activity = time.monotonic()
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = None
+        self._readers = None
+        # Group commit
+        self.group_commit = group_commit
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._batch = []
+        self._flush_handle = None
+        self._flushing = set()
+
+    # -------------------------------------------------------------------------
+    # Ciclo de vida
+    # -------------------------------------------------------------------------
+    def open(self) -> None:
+        """Cria o schema e sobe os threads de leitura/escrita (idempotente)."""
+        if self._writer is not None:
+            return
+        conn = _connect(self.db_name)
+        try:
+            self._create_schema(conn)
+        finally:
+            conn.close()
+        self._writer = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="sqlite-writer",
+            initializer=self._init_thread,
+        )
+        self._readers = ThreadPoolExecutor(
+            max_workers=self.read_pool_size,
+            thread_name_prefix="sqlite-reader",
+            initializer=self._init_thread,
+        )
+        logger.info("Pool SQLite pronto: 1 escritor, %d leitores", self.read_pool_size)
+
+    def close(self) -> None:
+        """Aguarda as consultas pendentes e fecha todas as conexões."""
+        if self._writer is None:
+            return
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self._writer = self._readers = None
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        logger.info("Pool SQLite encerrado.")
+
+    def _init_thread(self) -> None:
+        conn = _connect(self.db_name, self.synchronous)
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        self.auto_vacuum = _enable_incremental_vacuum(conn, self.convert_auto_vacuum)
+        version = migrations.migrate(conn)
+        logger.info("Schema do banco na versão %d", version)
+        for name, plan in migrations.check_query_plans(conn, HOT_QUERIES):
+            logger.warning("Consulta quente '%s' não usa o índice esperado: %s", name, plan)
+
+    # -------------------------------------------------------------------------
+    # Execução nos threads dedicados
+    # -------------------------------------------------------------------------
+    async def _run(self, executor: ThreadPoolExecutor, func, *args):
+        if executor is None:
+            raise RuntimeError("TaskStorage não foi aberto (chame setup_database).")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self._call, func, args)
+
+    def _call(self, func, args):
+        return func(self._local.conn, *args)
+
+    async def read(self, func, *args):
+        """Executa `func(conn, *args)` num thread de leitura."""
+        self.last_activity = time.monotonic()
+        if self.query_observer is None:
+            return await self._run(self._readers, func, *args)
+        started = time.perf_counter()
+        try:
+            return await self._run(self._readers, func, *args)
+        finally:
+            self.query_observer('read', func.__name__.lstrip('_'), time.perf_counter() - started)
+
+    async def write(self, func, *args):
+        """Executa `func(conn, *args)` no thread de escrita, dentro de uma transação.
+
+        Com group commit, a operação entra no próximo lote e o `await` só
+        termina depois que o lote foi gravado.
+        """
+        self.last_activity = time.monotonic()
+        if self.query_observer is None:
+            return await self._write(func, *args)
+        started = time.perf_counter()
+        try:
+            return await self._write(func, *args)
+        finally:
+            self.query_observer('write', func.__name__.lstrip('_'), time.perf_counter() - started)
+
+    async def maintenance(self, func, *args):
+        """Como `write`, mas fora do group commit e sem contar como atividade.
+
+        Para o trabalho de fundo (arquivamento, VACUUM incremental, optimize).
+        """
+        started = time.perf_counter()
+        try:
+            return await self._run(self._writer, self._transaction, func, *args)
+        finally:
+            if self.query_observer is not None:
+                self.query_observer('maintenance', func.__name__.lstrip('_'), time.perf_counter() - started)
+
+    @property
+    def incremental_vacuum_enabled(self) -> bool:
+        """O banco aceita PRAGMA incremental_vacuum (auto_vacuum = INCREMENTAL)."""
+        return self.auto_vacuum == 2
+
+    def idle_for(self) -> float:
+        """Segundos desde a última consulta dos handlers."""
+        return time.monotonic() - self.last_activity
+
+    async def _write(self, func, *args):
+        if not self.group_commit:
+            return await self._run(self._writer, self._transaction, func, *args)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((func, args, future))
+        if len(self._batch) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._start_flush)
+        return await future
+
+    @staticmethod
+    def _transaction(conn: sqlite3.Connection, func, *args):
+        with conn:
+            return func(conn, *args)
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        task = asyncio.ensure_future(self._flush_batch(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush_batch(self, batch: list) -> None:
+        operations = [(func, args) for func, args, _ in batch]
+        try:
+            results = await self._run(self._writer, _run_batch, operations)
+        except Exception as e:
+            # O COMMIT falhou: nada do lote foi gravado
+            logger.error("Erro ao gravar lote de %d escritas: %s", len(batch), e)
+            results = [(False, e)] * len(batch)
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def flush(self) -> None:
+        """Grava imediatamente o lote pendente e espera os lotes em andamento."""
+        self._start_flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    # -------------------------------------------------------------------------
+    # Cache de pendentes
+    # -------------------------------------------------------------------------
+    async def _cached_pending(self, user_id: int):
+        """Pendentes do usuário via cache (None se forem muitas para guardar)."""
+        rows = self.cache.get(user_id)
+        if rows is _OVERSIZED:
+            return None
+        if rows is not None:
+            return rows
+
+        # Uma escrita concluída durante a leitura invalida o resultado
+        loading = [True]
+        self._loading.setdefault(user_id, []).append(loading)
+        try:
+            rows = await self.read(_select_pending, user_id, self.max_cached_rows + 1)
+        finally:
+            flags = self._loading[user_id]
+            flags.remove(loading)
+            if not flags:
+                del self._loading[user_id]
+
+        if len(rows) > self.max_cached_rows:
+            if loading[0]:
+                self.cache.put(user_id, _OVERSIZED)
+            return None
+        rows = [dict(row) for row in rows]
+        if loading[0]:
+            self.cache.put(user_id, rows)
+        return rows
+
+    def _invalidate_loading(self, user_id: int) -> None:
+        for loading in self._loading.get(user_id, ()):
+            loading[0] = False
+
+    def _cache_add(self, user_id: int, row: dict) -> None:
+        self._invalidate_loading(user_id)
+        rows = self.cache.peek(user_id)
+        if rows is None or rows is _OVERSIZED:
+            return
+        ids = [cached['id'] for cached in rows]
+        position = bisect.bisect_left(ids, row['id'])
+        if position < len(ids) and ids[position] == row['id']:
+            return
+        if len(rows) >= self.max_cached_rows:
+            self.cache.put(user_id, _OVERSIZED)
+            return
+        rows.insert(position, row)
+
+    def _cache_remove(self, user_id: int, task_ids) -> None:
+        self._invalidate_loading(user_id)
+        rows = self.cache.peek(user_id)
+        if rows is None:
+            return
+        if rows is _OVERSIZED:
+            # Pode ter voltado para baixo do limite: a próxima leitura confere
+            self.cache.pop(user_id)
+            return
+        task_ids = set(task_ids)
+        rows[:] = [row for row in rows if row['id'] not in task_ids]
+
+    def cache_metrics(self) -> dict:
+        """Contadores do cache de pendentes (acertos, erros, despejos)."""
+        return self.cache.metrics()
+
+    # -------------------------------------------------------------------------
+    # API de tarefas
+    # -------------------------------------------------------------------------
+    async def add_task(
+        self, user_id: int, titulo: str, tipo_anexo: str = 'nenhum', id_anexo: str = None, due_at: int = None
+    ) -> int:
+        """Insere uma tarefa (com prazo opcional, em segundos UTC) e devolve o id gerado."""
+        task_id = await self.write(_insert_task, user_id, titulo, tipo_anexo, id_anexo, due_at)
+        self._cache_add(user_id, {
+            'id': task_id, 'titulo': titulo, 'tipo_anexo': tipo_anexo, 'id_anexo': id_anexo, 'due_at': due_at,
+        })
+        return task_id
+
+    async def pending_tasks(self, user_id: int) -> list:
+        """Lista as tarefas pendentes do usuário."""
+        rows = await self._cached_pending(user_id)
+        if rows is not None:
+            return list(rows)
+        return await self.read(_select_pending, user_id, -1)
+
+    async def pending_page(self, user_id: int, after_id: int = None, before_id: int = None, limit: int = 10) -> TaskPage:
+        """Página de pendentes com ids depois de `after_id` (ou antes de `before_id`)."""
+        rows = await self._cached_pending(user_id)
+        if rows is not None:
+            return _page_from_rows(rows, after_id, before_id, limit)
+        return await self.read(_select_pending_page, user_id, after_id, before_id, limit)
+
+    async def pending_media(self, user_id: int, after_id: int = 0, limit: int = 10) -> tuple:
+        """Pendentes com foto/vídeo depois de `after_id`: devolve (linhas, há_mais)."""
+        rows = await self._cached_pending(user_id)
+        if rows is not None:
+            media = [row for row in rows if row['id'] > after_id and row['tipo_anexo'] in MEDIA_TYPES]
+        else:
+            media = await self.read(_select_pending_media, user_id, after_id, limit + 1)
+        return media[:limit], len(media) > limit
+
+    async def update_attachment_ids(self, user_id: int, file_ids: dict) -> None:
+        """Troca o id_anexo das tarefas pelo file_id devolvido pelo Telegram."""
+        if not file_ids:
+            return
+        await self.write(_update_attachment_ids, user_id, list(file_ids.items()))
+        self._invalidate_loading(user_id)
+        rows = self.cache.peek(user_id)
+        if rows is None or rows is _OVERSIZED:
+            return
+        for row in rows:
+            if row['id'] in file_ids:
+                row['id_anexo'] = file_ids[row['id']]
+
+    async def get_task(self, user_id: int, task_id: int):
+        """Busca uma tarefa do usuário pelo id (None se não existir ou for de outro usuário)."""
+        return await self.read(_select_task, user_id, task_id)
+
+    async def search(self, user_id: int, termo: str, limit: int = 10, offset: int = 0) -> tuple:
+        """Busca nas pendentes do usuário por relevância: devolve (linhas, há_mais)."""
+        query = _fts_query(user_id, termo)
+        if query is None or offset >= MAX_SEARCH_RESULTS:
+            return [], False
+        limit = min(limit, MAX_SEARCH_RESULTS - offset)
+        rows = await self.read(_search_tasks, user_id, query, limit + 1, offset)
+        has_more = len(rows) > limit and offset + limit < MAX_SEARCH_RESULTS
+        return rows[:limit], has_more
+
+    async def backfill_search_index(self, chunk_size: int = 500, pause: float = 0.05) -> None:
+        """Indexa, em lotes curtos, as tarefas que existiam antes da busca (uma vez só)."""
+        total = 0
+        while True:
+            indexed = await self.write(_backfill_search_chunk, chunk_size)
+            if indexed is None:
+                break
+            total += indexed
+            # Devolve o escritor para os handlers entre um lote e outro
+            await asyncio.sleep(pause)
+        if total:
+            logger.info("Índice de busca preenchido: %d tarefas antigas indexadas", total)
+
+    async def claim_due_reminders(self, now: int, lease_until: int, limit: int) -> list:
+        """Reserva até `limit` lembretes vencidos (prazo <= now) até `lease_until`.
+
+        A reserva é um único UPDATE ... RETURNING: dois despachantes nunca
+        recebem a mesma tarefa, e uma reserva de quem caiu expira sozinha.
+        """
+        rows = await self.write(_claim_due_reminders, now, lease_until, limit)
+        return sorted((dict(row) for row in rows), key=lambda row: (row['due_at'], row['id']))
+
+    async def upcoming_reminders(self, until: int, limit: int) -> list:
+        """(due_at, id) dos próximos lembretes ainda não enviados com prazo <= `until`."""
+        rows = await self.read(_select_upcoming_reminders, until, limit)
+        return [(row['due_at'], row['id']) for row in rows]
+
+    async def finish_reminders(self, sent_ids, retry_ids, retry_at: int) -> None:
+        """Marca os lembretes entregues e adia a próxima tentativa dos que falharam."""
+        sent_ids, retry_ids = list(sent_ids), list(retry_ids)
+        if sent_ids or retry_ids:
+            await self.write(_finish_reminders, sent_ids, retry_ids, retry_at)
+
+    async def export_tasks(self, user_id: int, fmt: str, output) -> int:
+        """Grava todas as tarefas do usuário em `output` (arquivo binário) e devolve quantas.
+
+        Roda inteira num thread de leitura: o cursor é consumido em lotes e
+        cada lote vai direto para o arquivo, sem montar a lista completa.
+        """
+        return await self.read(_export_tasks, user_id, fmt, output)
+
+    async def import_tasks(self, user_id: int, rows: list) -> int:
+        """Insere um lote de tarefas importadas (tuplas de transfer.normalize_record)."""
+        if not rows:
+            return 0
+        await self.write(_insert_many, user_id, rows)
+        # Recarrega do banco na próxima listagem
+        self._invalidate_loading(user_id)
+        self.cache.pop(user_id)
+        return len(rows)
+
+    async def history_page(self, user_id: int, before: tuple = None, limit: int = 10) -> tuple:
+        """Concluídas (recentes e arquivadas), da mais nova para a mais antiga.
+
+        `before` é o (done_at, id) da última linha da página anterior.
+        Devolve (linhas, há_mais).
+        """
+        rows = await self.read(_select_history, user_id, before or HISTORY_START, limit + 1)
+        return rows[:limit], len(rows) > limit
+
+    async def archive_completed(self, cutoff: int, limit: int) -> int:
+        """Move até `limit` concluídas antes de `cutoff` para o arquivo e devolve quantas."""
+        return await self.maintenance(_archive_batch, cutoff, limit)
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Devolve até `pages` páginas livres ao sistema; retorna quantas ainda sobram."""
+        return await self.maintenance(_incremental_vacuum, pages)
+
+    async def optimize(self) -> None:
+        """PRAGMA optimize (atualiza as estatísticas do planejador quando preciso)."""
+        await self.maintenance(_optimize)
+
+    async def complete(self, user_id: int, task_id: int) -> bool:
+        """Marca a tarefa como concluída. Só afeta tarefas do próprio usuário."""
+        return bool(await self.complete_many(user_id, [task_id]))
+
+    async def delete(self, user_id: int, task_id: int) -> bool:
+        """Apaga a tarefa. Só afeta tarefas do próprio usuário."""
+        return bool(await self.delete_many(user_id, [task_id]))
+
+    async def complete_many(self, user_id: int, task_ids) -> list:
+        """Conclui várias tarefas num único UPDATE e devolve os ids afetados.
+
+        O filtro por `user_id` faz parte da mesma consulta: ids de outros
+        usuários são simplesmente ignorados.
+        """
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        done = await self.write(_mark_done_many, user_id, task_ids)
+        self._cache_remove(user_id, done)
+        return done
+
+    async def delete_many(self, user_id: int, task_ids) -> list:
+        """Apaga várias tarefas do usuário numa única consulta e devolve os ids afetados."""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        deleted = await self.write(_delete_many, user_id, task_ids)
+        self._cache_remove(user_id, deleted)
+        return deleted
+
+    async def complete_all(self, user_id: int) -> list:
+        """Conclui todas as pendentes do usuário e devolve os ids afetados."""
+        done = await self.write(_mark_all_done, user_id)
+        self._cache_remove(user_id, done)
+        return done
+
+
+def _enable_incremental_vacuum(conn: sqlite3.Connection, convert: bool) -> int:
+    """Liga o auto_vacuum incremental e devolve o modo final do banco.
+
+    Banco novo: de graça. Banco existente: só com `convert`, porque custa um
+    VACUUM completo; sem ele o banco continua como está e só é avisado.
+    """
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode == 2:
+        return mode
+    if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        if not convert:
+            logger.info(
+                "Banco sem auto_vacuum incremental: o espaço das tarefas arquivadas é reaproveitado, "
+                "mas o arquivo não diminui. Para converter, pare o bot e suba uma vez com "
+                "COMPACT_DB_ON_START=1 (VACUUM completo, precisa do dobro do espaço em disco)."
+            )
+            return mode
+        logger.info("Ativando auto_vacuum incremental (VACUUM completo, pode demorar em bancos grandes)...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # O journal_mode=WAL do _connect já gravou o cabeçalho, então mesmo o
+        # banco vazio precisa do VACUUM (instantâneo, não há páginas)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+
+def _run_batch(conn: sqlite3.Connection, operations: list) -> list:
+    """Roda um lote de escritas numa transação; cada uma isolada num SAVEPOINT."""
+    results = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for func, args in operations:
+            conn.execute("SAVEPOINT operacao")
+            try:
+                value = func(conn, *args)
+            except Exception as e:
+                conn.execute("ROLLBACK TO operacao")
+                results.append((False, e))
+            else:
+                results.append((True, value))
+            conn.execute("RELEASE operacao")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return results
+
+
+# Limite de resultados por busca (somando todas as páginas)
+MAX_SEARCH_RESULTS = 50
+
+
+def _fts_query(user_id: int, termo: str):
+    """Monta a expressão MATCH: dono do usuário E todos os termos como prefixo."""
+    tokens = re.findall(r'\w+', termo or '')
+    if not tokens:
+        return None
+    terms = " AND ".join(f'"{token}"*' for token in tokens[:10])
+    return f'dono : "u{user_id}" AND titulo : ({terms})'
+
+
+def _search_tasks(conn, user_id, query, limit, offset):
+    cursor = conn.execute(
+        "SELECT t.id, t.titulo, t.tipo_anexo, t.id_anexo FROM tarefas_fts f "
+        "JOIN tarefas t ON t.id = f.rowid "
+        "WHERE tarefas_fts MATCH ? AND t.user_id = ? AND t.concluida = 0 "
+        "ORDER BY bm25(tarefas_fts, 1.0, 0.0) LIMIT ? OFFSET ?",
+        (query, user_id, limit, offset)
+    )
+    return cursor.fetchall()
+
+
+def _backfill_search_chunk(conn, chunk_size):
+    """Indexa o próximo lote do preenchimento; None quando não há mais nada."""
+    state = conn.execute("SELECT feito, fim FROM fts_backfill WHERE id = 1").fetchone()
+    if state is None or state['feito'] >= state['fim']:
+        return None
+    start = state['feito']
+    end = min(start + chunk_size, state['fim'])
+    cursor = conn.execute(
+        "INSERT INTO tarefas_fts (rowid, titulo, dono) "
+        "SELECT id, titulo, 'u' || user_id FROM tarefas "
+        "WHERE id > ? AND id <= ? AND concluida = 0",
+        (start, end)
+    )
+    conn.execute("UPDATE fts_backfill SET feito = ? WHERE id = 1", (end,))
+    return cursor.rowcount
+
+
+def _page_from_rows(rows: list, after_id, before_id, limit: int) -> TaskPage:
+    """Mesma paginação de `_select_pending_page`, sobre a lista em cache."""
+    ids = [row['id'] for row in rows]
+    if before_id is not None:
+        end = bisect.bisect_left(ids, before_id)
+        start = max(0, end - limit)
+    else:
+        start = bisect.bisect_right(ids, after_id or 0)
+        end = start + limit
+    if start >= end or start >= len(rows):
+        if after_id or before_id:
+            return _page_from_rows(rows, None, None, limit)
+        return TaskPage([], False, False, 0)
+    end = min(end, len(rows))
+    return TaskPage(rows[start:end], start > 0, end < len(rows), len(rows))
+
+
+# =============================================================================
+# CONSULTAS (RODAM DENTRO DOS THREADS DO POOL)
+# =============================================================================
+SQL_SELECT_PENDING = (
+    "SELECT id, titulo, tipo_anexo, id_anexo, due_at FROM tarefas "
+    "WHERE user_id = ? AND concluida = 0 ORDER BY id LIMIT ?"
+)
+
+SQL_PAGE_AFTER = (
+    "SELECT id, titulo, tipo_anexo, id_anexo, due_at FROM tarefas "
+    "WHERE user_id = ? AND concluida = 0 AND id > ? ORDER BY id LIMIT ?"
+)
+
+SQL_PAGE_BEFORE = (
+    "SELECT id, titulo, tipo_anexo, id_anexo, due_at FROM tarefas "
+    "WHERE user_id = ? AND concluida = 0 AND id < ? ORDER BY id DESC LIMIT ?"
+)
+
+SQL_COUNT_PENDING = "SELECT COUNT(*) FROM tarefas WHERE user_id = ? AND concluida = 0"
+
+# Lembretes vencidos e livres (sem reserva ou com a reserva expirada)
+SQL_DUE_REMINDERS = (
+    "SELECT id FROM tarefas "
+    "WHERE concluida = 0 AND reminded_at IS NULL AND due_at IS NOT NULL AND due_at <= ? "
+    "AND (reminder_lease IS NULL OR reminder_lease <= ?) ORDER BY due_at LIMIT ?"
+)
+
+SQL_UPCOMING_REMINDERS = (
+    "SELECT id, due_at FROM tarefas "
+    "WHERE concluida = 0 AND reminded_at IS NULL AND due_at IS NOT NULL AND due_at <= ? "
+    "ORDER BY due_at LIMIT ?"
+)
+
+# Exportação: pendentes e depois concluídas, cada parte pelo seu índice parcial
+# (as concluídas na ordem do histórico, como as arquivadas)
+SQL_EXPORT_PENDING = (
+    f"SELECT {', '.join(transfer.COLUMNS)} FROM tarefas WHERE user_id = ? AND concluida = 0 ORDER BY id"
+)
+
+SQL_EXPORT_DONE = (
+    f"SELECT {', '.join(transfer.COLUMNS)} FROM tarefas WHERE user_id = ? AND concluida = 1 ORDER BY done_at, id"
+)
+
+SQL_EXPORT_ARCHIVED = (
+    "SELECT id, titulo, tipo_anexo, id_anexo, 1 AS concluida, created_at, done_at, due_at "
+    "FROM tarefas_arquivo WHERE user_id = ? ORDER BY done_at, id"
+)
+
+# Histórico: paginação por (done_at, id) decrescente nas duas tabelas
+HISTORY_START = (2 ** 62, 0)
+
+SQL_HISTORY_RECENT = (
+    "SELECT id, titulo, tipo_anexo, done_at FROM tarefas "
+    "WHERE user_id = ? AND concluida = 1 AND (done_at, id) < (?, ?) "
+    "ORDER BY done_at DESC, id DESC LIMIT ?"
+)
+
+SQL_HISTORY_ARCHIVED = (
+    "SELECT id, titulo, tipo_anexo, done_at FROM tarefas_arquivo "
+    "WHERE user_id = ? AND (done_at, id) < (?, ?) "
+    "ORDER BY done_at DESC, id DESC LIMIT ?"
+)
+
+SQL_ARCHIVE_CANDIDATES = (
+    "SELECT id FROM tarefas WHERE concluida = 1 AND done_at < ? ORDER BY done_at LIMIT ?"
+)
+
+# Consultas que precisam dos índices; verificadas ao abrir o banco
+HOT_QUERIES = {
+    'pending_tasks': (SQL_SELECT_PENDING, (0, -1), 'idx_tarefas_pendentes'),
+    'pending_page_after': (SQL_PAGE_AFTER, (0, 0, 10), 'idx_tarefas_pendentes'),
+    'pending_page_before': (SQL_PAGE_BEFORE, (0, 0, 10), 'idx_tarefas_pendentes'),
+    'count_pending': (SQL_COUNT_PENDING, (0,), 'idx_tarefas_pendentes'),
+    'due_reminders': (SQL_DUE_REMINDERS, (0, 0, 100), 'idx_tarefas_lembretes'),
+    'upcoming_reminders': (SQL_UPCOMING_REMINDERS, (0, 100), 'idx_tarefas_lembretes'),
+    'export_pending': (SQL_EXPORT_PENDING, (0,), 'idx_tarefas_pendentes'),
+    'export_done': (SQL_EXPORT_DONE, (0,), 'idx_tarefas_historico'),
+    'export_archived': (SQL_EXPORT_ARCHIVED, (0,), 'idx_arquivo_usuario'),
+    'history_recent': (SQL_HISTORY_RECENT, (0, *HISTORY_START, 10), 'idx_tarefas_historico'),
+    'history_archived': (SQL_HISTORY_ARCHIVED, (0, *HISTORY_START, 10), 'idx_arquivo_usuario'),
+    'archive_candidates': (SQL_ARCHIVE_CANDIDATES, (0, 500), 'idx_tarefas_concluidas_em'),
+}
+
+
+def _insert_task(conn, user_id, titulo, tipo_anexo, id_anexo, due_at=None):
+    cursor = conn.execute(
+        "INSERT INTO tarefas (user_id, titulo, tipo_anexo, id_anexo, created_at, due_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, titulo, tipo_anexo, id_anexo, int(time.time()), due_at)
+    )
+    return cursor.lastrowid
+
+
+def _insert_many(conn, user_id, rows):
+    now = int(time.time())
+    # Concluídas sempre têm done_at (o histórico e o arquivador dependem dele).
+    # Prazo já vencido entra como lembrado: reimportar um backup não pode
+    # disparar um lembrete para cada tarefa atrasada
+    conn.executemany(
+        "INSERT INTO tarefas "
+        "(user_id, titulo, tipo_anexo, id_anexo, concluida, created_at, done_at, due_at, reminded_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(user_id, titulo, tipo_anexo, id_anexo, concluida, created_at or now,
+          (done_at or now) if concluida else None, due_at,
+          now if due_at is not None and due_at <= now else None)
+         for titulo, tipo_anexo, id_anexo, concluida, created_at, done_at, due_at in rows]
+    )
+
+
+def _export_tasks(conn, user_id, fmt, output):
+    # Os cursores só são executados quando o gerador chega neles
+    cursors = (
+        conn.execute(sql, (user_id,)) for sql in (SQL_EXPORT_PENDING, SQL_EXPORT_DONE, SQL_EXPORT_ARCHIVED)
+    )
+    exported = 0
+    for chunk, rows in transfer.export_chunks(cursors, fmt):
+        output.write(chunk)
+        exported += rows
+    return exported
+
+
+def _select_history(conn, user_id, before, limit):
+    recent = conn.execute(SQL_HISTORY_RECENT, (user_id, *before, limit)).fetchall()
+    archived = conn.execute(SQL_HISTORY_ARCHIVED, (user_id, *before, limit)).fetchall()
+    merged = heapq.merge(recent, archived, key=lambda row: (row['done_at'], row['id']), reverse=True)
+    return list(itertools.islice(merged, limit))
+
+
+def _archive_batch(conn, cutoff, limit):
+    ids = [row[0] for row in conn.execute(SQL_ARCHIVE_CANDIDATES, (cutoff, limit))]
+    if not ids:
+        return 0
+    placeholders = ",".join("?" * len(ids))
+    conn.execute(
+        "INSERT INTO tarefas_arquivo "
+        "(id, user_id, titulo, tipo_anexo, id_anexo, created_at, done_at, due_at, archived_at) "
+        "SELECT id, user_id, titulo, tipo_anexo, id_anexo, created_at, done_at, due_at, ? "
+        f"FROM tarefas WHERE concluida = 1 AND id IN ({placeholders})",
+        (int(time.time()), *ids)
+    )
+    cursor = conn.execute(f"DELETE FROM tarefas WHERE concluida = 1 AND id IN ({placeholders})", ids)
+    return cursor.rowcount
+
+
+def _incremental_vacuum(conn, pages):
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def _optimize(conn):
+    conn.execute("PRAGMA optimize")
+
+
+def _select_pending(conn, user_id, limit):
+    cursor = conn.execute(SQL_SELECT_PENDING, (user_id, limit))
+    return cursor.fetchall()
+
+
+def _select_pending_page(conn, user_id, after_id, before_id, limit):
+    if before_id is not None:
+        rows = conn.execute(SQL_PAGE_BEFORE, (user_id, before_id, limit)).fetchall()[::-1]
+    else:
+        rows = conn.execute(SQL_PAGE_AFTER, (user_id, after_id or 0, limit)).fetchall()
+    if not rows and (after_id or before_id):
+        # A página pedida esvaziou (tarefas concluídas/apagadas): volta ao início
+        return _select_pending_page(conn, user_id, None, None, limit)
+    has_prev = has_next = False
+    if rows:
+        has_prev = conn.execute(SQL_PAGE_BEFORE, (user_id, rows[0]['id'], 1)).fetchone() is not None
+        has_next = conn.execute(SQL_PAGE_AFTER, (user_id, rows[-1]['id'], 1)).fetchone() is not None
+    total = conn.execute(SQL_COUNT_PENDING, (user_id,)).fetchone()[0]
+    return TaskPage(rows, has_prev, has_next, total)
+
+
+MEDIA_TYPES = ('foto', 'video')
+
+
+def _select_pending_media(conn, user_id, after_id, limit):
+    cursor = conn.execute(
+        "SELECT id, titulo, tipo_anexo, id_anexo, due_at FROM tarefas "
+        "WHERE user_id = ? AND concluida = 0 AND id > ? AND tipo_anexo IN ('foto', 'video') "
+        "ORDER BY id LIMIT ?",
+        (user_id, after_id, limit)
+    )
+    return cursor.fetchall()
+
+
+def _update_attachment_ids(conn, user_id, file_ids):
+    conn.executemany(
+        "UPDATE tarefas SET id_anexo = ? WHERE id = ? AND user_id = ?",
+        [(file_id, task_id, user_id) for task_id, file_id in file_ids]
+    )
+
+
+def _select_task(conn, user_id, task_id):
+    cursor = conn.execute(
+        "SELECT id, titulo, tipo_anexo, id_anexo, due_at, concluida FROM tarefas WHERE id = ? AND user_id = ?",
+        (task_id, user_id)
+    )
+    return cursor.fetchone()
+
+
+def _claim_due_reminders(conn, now, lease_until, limit):
+    # Um único comando: o lock de escrita é pego antes de escolher as linhas
+    cursor = conn.execute(
+        f"UPDATE tarefas SET reminder_lease = ? WHERE id IN ({SQL_DUE_REMINDERS}) "
+        "RETURNING id, user_id, titulo, due_at",
+        (lease_until, now, now, limit)
+    )
+    return cursor.fetchall()
+
+
+def _select_upcoming_reminders(conn, until, limit):
+    return conn.execute(SQL_UPCOMING_REMINDERS, (until, limit)).fetchall()
+
+
+def _finish_reminders(conn, sent_ids, retry_ids, retry_at):
+    now = int(time.time())
+    for chunk in _chunks(sent_ids):
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(
+            f"UPDATE tarefas SET reminded_at = ?, reminder_lease = NULL WHERE id IN ({placeholders})",
+            (now, *chunk)
+        )
+    for chunk in _chunks(retry_ids):
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(
+            f"UPDATE tarefas SET reminder_lease = ? WHERE reminded_at IS NULL AND id IN ({placeholders})",
+            (retry_at, *chunk)
+        )
+
+
+# Limite de ids por `IN (...)`, bem abaixo do máximo de parâmetros do SQLite
+MAX_IDS_PER_QUERY = 500
+
+
+def _chunks(items: list, size: int = MAX_IDS_PER_QUERY):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _mark_done_many(conn, user_id, task_ids):
+    done = []
+    now = int(time.time())
+    for chunk in _chunks(task_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(
+            "UPDATE tarefas SET concluida = 1, done_at = ? "
+            f"WHERE user_id = ? AND concluida = 0 AND id IN ({placeholders}) RETURNING id",
+            (now, user_id, *chunk)
+        )
+        done.extend(row[0] for row in cursor.fetchall())
+    return done
+
+
+def _mark_all_done(conn, user_id):
+    cursor = conn.execute(
+        "UPDATE tarefas SET concluida = 1, done_at = ? WHERE user_id = ? AND concluida = 0 RETURNING id",
+        (int(time.time()), user_id)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _delete_many(conn, user_id, task_ids):
+    deleted = []
+    for chunk in _chunks(task_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(
+            f"DELETE FROM tarefas WHERE user_id = ? AND id IN ({placeholders}) RETURNING id",
+            (user_id, *chunk)
+        )
+        deleted.extend(row[0] for row in cursor.fetchall())
+    return deleted
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import unittest
+
+from telegram import Chat, Message, Update, User
+
+from concurrency import PerUserUpdateProcessor
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Update:
+    user = User(user_id, 'Teste', False)
+    message = Message(update_id, None, Chat(user_id, 'private'), from_user=user, text=text)
+    return Update(update_id, message=message)
+
+
+class PerUserUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_backlog_of_one_user_does_not_hold_slots(self):
+        processor = PerUserUpdateProcessor(4)
+        finished = {}
+
+        async def handle(user_id: int, seconds: float):
+            await asyncio.sleep(seconds)
+            finished.setdefault(user_id, []).append(time.monotonic())
+
+        started = time.monotonic()
+        # Usuário A: fila maior que o número de vagas, 0,2 s por update
+        backlog = [
+            asyncio.ensure_future(processor.process_update(message_update(n, 1, "a"), handle(1, 0.2)))
+            for n in range(8)
+        ]
+        await asyncio.sleep(0.01)
+        await processor.process_update(message_update(100, 2, "b"), handle(2, 0))
+        # B termina logo, enquanto A ainda tem quase toda a fila pela frente
+        self.assertLess(finished[2][0] - started, 0.3)
+        self.assertLess(len(finished.get(1, [])), 2)
+        await asyncio.gather(*backlog)
+        self.assertEqual(len(finished[1]), 8)
+
+    async def test_limits_running_updates(self):
+        processor = PerUserUpdateProcessor(2)
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(
+            processor.process_update(message_update(n, n, "x"), handle()) for n in range(10)
+        ))
+        self.assertEqual(peak, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
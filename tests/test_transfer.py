@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import transfer
+
+
+def _write(directory: str, name: str, content: str) -> str:
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as output:
+        output.write(content)
+    return path
+
+
+class ImportJSONTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        self.tasks = [
+            {'titulo': f'Tarefa {number}', 'tipo_anexo': 'link', 'id_anexo': f'https://exemplo.com/{number}',
+             'concluida': number % 2}
+            for number in range(25)
+        ]
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _import(self, path: str) -> list:
+        rows = []
+        for chunk, invalid in transfer.import_chunks(path, 'json', chunk_size=10):
+            self.assertEqual(invalid, 0)
+            rows.extend(chunk)
+        return rows
+
+    def test_indented_array(self):
+        path = _write(self.directory, 'tarefas.json', json.dumps(self.tasks, indent=2))
+        rows = self._import(path)
+        self.assertEqual([row[0] for row in rows], [task['titulo'] for task in self.tasks])
+
+    def test_compact_array(self):
+        path = _write(self.directory, 'tarefas.json', json.dumps(self.tasks))
+        self.assertEqual(len(self._import(path)), len(self.tasks))
+
+    def test_export_roundtrip(self):
+        rows = [(number, f'Tarefa {number}', 'nenhum', None, 0, 1700000000, None, None) for number in range(5)]
+        exported = b''.join(data for data, _ in transfer.export_chunks([FakeCursor(rows)], 'json'))
+        path = _write(self.directory, 'tarefas.json', exported.decode('utf-8'))
+        self.assertEqual([row[0] for row in self._import(path)], [row[1] for row in rows])
+
+    def test_small_reads_split_values(self):
+        items = list(transfer._json_array_items(io.StringIO(json.dumps(self.tasks, indent=2)), read_size=3))
+        self.assertEqual(items, self.tasks)
+
+    def test_invalid_json(self):
+        for content in ('{"titulo": "a"}', '[{"titulo": "a"} {"titulo": "b"}]', '[{"titulo": "a"},'):
+            with self.subTest(content=content):
+                with self.assertRaises(ValueError):
+                    list(transfer._json_array_items(io.StringIO(content)))
+
+
+class FakeCursor:
+    """Imita o fetchmany de um cursor do SQLite sobre uma lista."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+if __name__ == '__main__':
+    unittest.main()
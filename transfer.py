@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# EXPORTAÇÃO E IMPORTAÇÃO DE TAREFAS (CSV E JSON)
+# =============================================================================
+# Os dois lados trabalham em fluxo, um lote de linhas por vez:
+#   - exportação: o cursor do SQLite é lido com fetchmany e cada lote vira
+#     bytes num gerador, gravados direto no arquivo de saída;
+#   - importação: o arquivo é lido linha a linha e entregue em lotes já
+#     validados, prontos para um executemany.
+#
+# O JSON exportado é um array com um objeto por linha. Na importação, qualquer
+# array JSON (compacto, indentado, um objeto por linha) é lido em fluxo, um
+# elemento por vez, com o JSONDecoder.raw_decode sobre um buffer.
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+EXPORT_FORMATS = ('csv', 'json')
+
+# Colunas exportadas (e aceitas na importação), na ordem do CSV
+COLUMNS = ('id', 'titulo', 'tipo_anexo', 'id_anexo', 'concluida', 'created_at', 'done_at', 'due_at')
+TIMESTAMP_COLUMNS = ('created_at', 'done_at', 'due_at')
+ATTACHMENT_TYPES = ('nenhum', 'foto', 'video', 'link')
+
+
+def _format_timestamp(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+
+def _parse_timestamp(value):
+    """Aceita segundos desde a época ou ISO 8601 (sem fuso = UTC)."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip()
+    if value.lstrip('-').isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+# =============================================================================
+# EXPORTAÇÃO
+# =============================================================================
+def export_chunks(cursors, fmt: str, batch_size: int = 500):
+    """Gera (bytes, linhas) do arquivo exportado, lendo `batch_size` linhas por vez de cada cursor."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(COLUMNS)
+        # BOM para o Excel reconhecer o UTF-8 dos títulos
+        yield '\ufeff'.encode('utf-8') + buffer.getvalue().encode('utf-8'), 0
+    else:
+        yield b'[\n', 0
+    first = True
+    for cursor in cursors:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                record = dict(zip(COLUMNS, row))
+                for column in TIMESTAMP_COLUMNS:
+                    record[column] = _format_timestamp(record[column])
+                if fmt == 'csv':
+                    writer.writerow(['' if record[column] is None else record[column] for column in COLUMNS])
+                else:
+                    if not first:
+                        buffer.write(',\n')
+                    buffer.write(json.dumps(record, ensure_ascii=False))
+                first = False
+            yield buffer.getvalue().encode('utf-8'), len(rows)
+    if fmt == 'json':
+        yield b'\n]\n', 0
+
+
+# =============================================================================
+# IMPORTAÇÃO
+# =============================================================================
+def normalize_record(record: dict):
+    """Valida um registro importado e devolve a tupla para o INSERT (None se inválido)."""
+    titulo = str(record.get('titulo') or '').strip()
+    if not titulo:
+        return None
+    tipo_anexo = str(record.get('tipo_anexo') or 'nenhum').strip()
+    if tipo_anexo not in ATTACHMENT_TYPES:
+        return None
+    id_anexo = record.get('id_anexo') or None
+    if tipo_anexo == 'nenhum':
+        id_anexo = None
+    elif not isinstance(id_anexo, str) or not id_anexo.strip():
+        # file_id de foto/vídeo é sempre texto; número ou lista quebraria o álbum da galeria
+        return None
+    else:
+        id_anexo = id_anexo.strip()
+        # Mesma regra do get_link: a URL vira botão e o Telegram recusa qualquer outra coisa
+        if tipo_anexo == 'link' and not id_anexo.startswith(('http://', 'https://')):
+            return None
+    concluida = 1 if str(record.get('concluida') or '0').strip().lower() in ('1', 'true', 'sim') else 0
+    try:
+        created_at, done_at, due_at = (_parse_timestamp(record.get(column)) for column in TIMESTAMP_COLUMNS)
+    except ValueError:
+        return None
+    return (titulo, tipo_anexo, id_anexo, concluida, created_at, done_at if concluida else None, due_at)
+
+
+def _records(path: str, fmt: str):
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8-sig') as source:
+            yield from csv.DictReader(source)
+        return
+    with open(path, encoding='utf-8-sig') as source:
+        for record in _json_array_items(source):
+            yield record if isinstance(record, dict) else {}
+
+
+# Quanto do arquivo JSON é lido de cada vez para o buffer
+JSON_READ_SIZE = 64 * 1024
+
+
+def _json_array_items(source, read_size: int = JSON_READ_SIZE):
+    """Gera os elementos de um array JSON lendo o arquivo aos pedaços.
+
+    Aceita qualquer formatação; só o elemento atual (e o resto do pedaço lido)
+    fica em memória.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, consumed, eof = '', 0, 0, False
+
+    def fill():
+        # Descarta o que já foi lido e acrescenta mais um pedaço; False no fim do arquivo
+        nonlocal buffer, pos, consumed, eof
+        consumed += pos
+        chunk = source.read(read_size)
+        buffer, pos = buffer[pos:] + chunk, 0
+        eof = not chunk
+        return not eof
+
+    def next_char():
+        # Primeiro caractere não branco a partir de `pos` ('' no fim do arquivo)
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return buffer[pos:pos + 1]
+
+    if next_char() != '[':
+        raise ValueError("o JSON precisa ser uma lista de tarefas")
+    pos += 1
+    first = True
+    while True:
+        char = next_char()
+        if char == ']':
+            return
+        if not first:
+            if char != ',':
+                raise ValueError(f"JSON inválido perto do caractere {consumed + pos}")
+            pos += 1
+            next_char()
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                item, end = None, None
+            # Um valor que termina junto com o buffer pode estar cortado (ex.: um número)
+            if end is not None and (end < len(buffer) or eof):
+                break
+            if not fill():
+                if end is not None:
+                    break
+                raise ValueError(f"JSON inválido perto do caractere {consumed + pos}")
+        pos = end
+        first = False
+        yield item
+
+
+def import_format(file_name: str):
+    """Formato pelo nome do arquivo enviado (None se não for CSV/JSON)."""
+    extension = (file_name or '').rsplit('.', 1)[-1].lower()
+    return extension if extension in EXPORT_FORMATS else None
+
+
+def import_chunks(path: str, fmt: str, chunk_size: int = 1000, max_rows: int = 100000):
+    """Gera (linhas válidas, quantidade de inválidas) em lotes de até `chunk_size`."""
+    rows, invalid, total = [], 0, 0
+    for record in _records(path, fmt):
+        if total >= max_rows:
+            raise ValueError(f"o arquivo passa do limite de {max_rows} tarefas")
+        total += 1
+        row = normalize_record(record)
+        if row is None:
+            invalid += 1
+        else:
+            rows.append(row)
+        if len(rows) + invalid >= chunk_size:
+            yield rows, invalid
+            rows, invalid = [], 0
+    if rows or invalid:
+        yield rows, invalid